@@ -1,7 +1,11 @@
 # app.py — главный
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort
+from flask import (Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, session, abort,
+                   jsonify, g, send_file, make_response)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_wtf import FlaskForm, CSRFProtect
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import (StringField, PasswordField, SubmitField, FloatField,
                      TextAreaField, BooleanField, SelectField, ValidationError)
@@ -11,18 +15,37 @@ from wtforms.validators import DataRequired, Length, NumberRange
 from werkzeug.utils import secure_filename
 from models import db, Category, Product, Admin
 from uuid import uuid4
-from sqlalchemy import or_
+from sqlalchemy import or_, func, select, exists
+from sqlalchemy.orm import contains_eager
 from PIL import Image
 import io
+import json
+import hashlib
 import time
-from collections import defaultdict
-from threading import Lock
 from datetime import timedelta
+from collections import namedtuple
 
 
 #================для обработки картинок           =======
 
-from utils.image_processor import process_product_image
+from utils.image_processor import (process_product_image, image_status, delete_product_images, render_width,
+                                   available_formats, SIZES, FORMATS)
+from utils.image_manifest import image_manifest
+from utils.image_cache import image_cache
+from utils.rate_limit import create_limiter
+from utils.cart import add_items, merge_items, set_quantities, cart_summary, cart_line, ensure_cart_constraints
+from utils.guest_cart import load_guest_cart, dump_guest_cart, GuestCartFull, COOKIE_NAME as GUEST_CART_COOKIE
+from utils import passwords
+from utils.db_profile import DEFAULT_PRAGMAS, apply_pragmas, create_read_engine
+from utils.secret_key import load_secret_key
+from utils.passwords import PasswordHasherBusy, needs_rehash
+from utils.search import ensure_search_index, search_index_ready, match_subquery
+from utils.pagination import keyset_page, encode_cursor, decode_cursor
+from utils.indexes import ensure_catalog_indexes
+from utils.cache import query_cache, fragment_cache, page_cache, search_cache, principal_cache, CachedPage
+from utils.versions import read_versions, VersionedSnapshot, CATEGORIES, CATALOG
+from utils.attributes import (ensure_attribute_index, facet_counts, lookup_key,
+                              normalize_size, normalize_tag)
 
 
 import os
@@ -30,93 +53,180 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 
 # ВАЖНО: импорт  СРАЗУ!
-from models import db, Category, Product, User, CartItem
-
-
-# Создаём приложение==============
-app = Flask(__name__)
-
-app.config['SECRET_KEY'] = os.urandom(32)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(basedir, 'instance', 'shop.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'static', 'images', 'products')
-app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'webp', 'gif'}
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1)  # 1 день
+from models import db, Category, Product, User, CartItem, Brand, Color, ProductSize, ProductTag
+
+
+# Маршруты — в blueprint; приложение собирает create_app() (flask --app app, wsgi.py)
+bp = Blueprint('shop', __name__, cli_group=None)
+
+# Настройки по умолчанию; поверх — instance/config.py, SHOP_* и config из create_app()
+DEFAULT_CONFIG = {}
+
+DEFAULT_CONFIG['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(basedir, 'instance', 'shop.db')}"
+DEFAULT_CONFIG['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# пул соединений SQLite: потоки воркера берут готовые соединения, timeout драйвера — на случай
+# BEGIN во время чужой записи (сами ожидания — PRAGMA busy_timeout ниже)
+DEFAULT_CONFIG['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 8, 'max_overflow': 8, 'pool_timeout': 10,
+                                           'connect_args': {'timeout': 5}}
+DEFAULT_CONFIG['SQLITE_PRAGMAS'] = dict(DEFAULT_PRAGMAS)   # WAL, synchronous=NORMAL, busy_timeout...
+DEFAULT_CONFIG['SQLITE_READ_POOL'] = False   # True — SELECT в GET-запросах через отдельный пул mode=ro
+DEFAULT_CONFIG['SQLITE_READ_POOL_SIZE'] = 8
+DEFAULT_CONFIG['UPLOAD_FOLDER'] = os.path.join(basedir, 'static', 'images', 'products')
+DEFAULT_CONFIG['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
+DEFAULT_CONFIG['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'webp', 'gif'}
+# фото товаров режутся в фоне, в отдельном пуле процессов (False — прямо в запросе, как раньше)
+DEFAULT_CONFIG['IMAGE_ASYNC'] = True
+DEFAULT_CONFIG['IMAGE_WORKERS'] = 2          # процессов на один веб-процесс
+DEFAULT_CONFIG['IMAGE_QUEUE_SIZE'] = 16      # сколько фото может ждать обработки
+DEFAULT_CONFIG['IMAGE_STAGING_FOLDER'] = os.path.join(basedir, 'instance', 'image_staging')
+DEFAULT_CONFIG['IMAGE_STAGING_TIMEOUT'] = 120   # .upload без задачи дольше — обработка оборвалась
+DEFAULT_CONFIG['IMAGE_FORMATS'] = ('jpeg', 'webp')   # + 'avif', если Pillow собран с libavif
+DEFAULT_CONFIG['IMAGE_MANIFEST_FOLDER'] = os.path.join(basedir, 'instance', 'image_manifest')
+# /img/<id>/<width>.<fmt>: разрешённые ширины и дисковый кэш нарезанных по запросу фото
+DEFAULT_CONFIG['IMAGE_WIDTHS'] = (160, 240, 320, 480, 640, 800, 960, 1200)
+DEFAULT_CONFIG['IMAGE_CACHE_FOLDER'] = os.path.join(basedir, 'instance', 'image_cache')
+DEFAULT_CONFIG['IMAGE_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+DEFAULT_CONFIG['IMAGE_CACHE_MAX_AGE'] = 3600
+DEFAULT_CONFIG['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1)  # 1 день
+DEFAULT_CONFIG['PAGE_SIZE'] = 24            # товаров на одной странице каталога/поиска
+DEFAULT_CONFIG['MAX_PAGE_SIZE'] = 96        # потолок для ?per_page=
+DEFAULT_CONFIG['NOVELTIES_PAGE_SIZE'] = 10
+DEFAULT_CONFIG['QUERY_CACHE_MAX_ENTRIES'] = 256   # кэш запросов каталога: сколько разных страниц
+DEFAULT_CONFIG['QUERY_CACHE_MAX_ROWS'] = 5000     # и сколько товаров в нём всего (лимит памяти)
+DEFAULT_CONFIG['FRAGMENT_CACHE_MAX_ENTRIES'] = 4096   # готовые карточки товаров
+DEFAULT_CONFIG['FRAGMENT_CACHE_MAX_KB'] = 16 * 1024   # ~16 МБ HTML на процесс
+# готовые страницы для гостей (без входа, с пустой корзиной): главная, каталог, новинки, товар, «О нас»
+DEFAULT_CONFIG['PAGE_CACHE'] = True
+DEFAULT_CONFIG['PAGE_CACHE_MAX_ENTRIES'] = 512
+DEFAULT_CONFIG['PAGE_CACHE_MAX_KB'] = 32 * 1024      # ~32 МБ HTML на процесс
+DEFAULT_CONFIG['PAGE_CACHE_TTL'] = 300               # страница перерисовывается не реже, чем раз в 5 минут
+# каталог и новинки во время правок админа: пока один поток перерисовывает страницу, остальные
+# гости до стольких секунд получают прежнюю копию (0 — всегда ждать свежую)
+DEFAULT_CONFIG['PAGE_CACHE_STALE_SECONDS'] = 10
+# скомпилированные шаблоны на диске: новый воркер не компилирует base.html и остальные заново.
+# TEMPLATES_AUTO_RELOAD: None — как DEBUG; serve.py выключает проверку изменений шаблонов
+DEFAULT_CONFIG['TEMPLATE_CACHE_FOLDER'] = os.path.join(basedir, 'instance', 'jinja_cache')
+# выдача поиска: список id на параметры запроса (пока не сменилось поколение каталога),
+# товары страницы — одним запросом по id
+DEFAULT_CONFIG['SEARCH_CACHE_MAX_ENTRIES'] = 1024
+DEFAULT_CONFIG['SEARCH_CACHE_TTL'] = 600
+DEFAULT_CONFIG['SEARCH_CACHE_MAX_IDS'] = 480        # 20 страниц по 24; дальше — обычный запрос по ключу
+DEFAULT_CONFIG['PRINCIPAL_CACHE_TTL'] = 30        # сколько секунд воркер помнит вошедшего пользователя
+DEFAULT_CONFIG['GUEST_CART_MAX_AGE'] = 30 * 24 * 3600   # корзина гостя (cookie) живёт месяц
 
 
 #  ========лимитер попыток входа   ========
 # Ограничение: не более LOGIN_MAX_ATTEMPTS попыток в LOGIN_WINDOW_SECONDS
 LOGIN_MAX_ATTEMPTS = 5
 LOGIN_WINDOW_SECONDS = 15 * 60  # 15 минут
-_login_attempts = defaultdict(list)
-_attempts_lock = Lock()
-
-def _prune_attempts(key):
-    now = time.time()
-    window_start = now - LOGIN_WINDOW_SECONDS
-    with _attempts_lock:
-        lst = _login_attempts.get(key, [])
-        lst = [t for t in lst if t >= window_start]
-        if lst:
-            _login_attempts[key] = lst
-        else:
-            _login_attempts.pop(key, None)
-        return len(lst)
-
-def _record_failed(key):
-    now = time.time()
-    with _attempts_lock:
-        _login_attempts[key].append(now)
-
-def _is_blocked(key):
-    cnt = _prune_attempts(key)
-    return cnt >= LOGIN_MAX_ATTEMPTS
-
-def _remaining_block_seconds(key):
-    
-    with _attempts_lock:
-        lst = _login_attempts.get(key, [])
-        if not lst:
-            return 0
-        earliest = min(lst)
-    expires = earliest + LOGIN_WINDOW_SECONDS
-    rem = int(expires - time.time())
-    return rem if rem > 0 else 0
-
-
-
-# делаем папки (потом проверить!)
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(os.path.join(basedir, 'instance'), exist_ok=True)  # ← важная строка!
+# 'sqlite' — счётчики общие для всех воркеров на машине; 'memory' — только для одного процесса
+DEFAULT_CONFIG['LOGIN_LIMITER_BACKEND'] = 'sqlite'
+DEFAULT_CONFIG['LOGIN_LIMITER_PATH'] = os.path.join(basedir, 'instance', 'ratelimit.db')
+# пароли: scrypt считается в отдельном пуле процессов; при смене N/r/p хэш пересчитается при входе
+DEFAULT_CONFIG['PASSWORD_SCRYPT_N'] = 2 ** 15
+DEFAULT_CONFIG['PASSWORD_SCRYPT_R'] = 8
+DEFAULT_CONFIG['PASSWORD_SCRYPT_P'] = 1
+DEFAULT_CONFIG['PASSWORD_POOL'] = True
+DEFAULT_CONFIG['PASSWORD_WORKERS'] = 2       # одновременно считаемых хэшей
+DEFAULT_CONFIG['PASSWORD_QUEUE_SIZE'] = 32   # сколько входов может ждать, остальным — «попробуйте ещё раз»
+
+# SECRET_KEY: из instance/config.py или SHOP_SECRET_KEY, иначе — из файла instance/secret_key
+# (создаётся при первом запуске). Один ключ на все воркеры и перезапуски
+DEFAULT_CONFIG['SECRET_KEY_FILE'] = os.path.join(basedir, 'instance', 'secret_key')
 
 # Защита от CSRF и Flask-Login
-csrf = CSRFProtect(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+csrf = CSRFProtect()
+login_manager = LoginManager()
+login_manager.login_view = 'shop.login'
 login_manager.login_message_category = "info"
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
-            return redirect(url_for('login'))
+            return redirect(url_for('shop.login'))
         if not (hasattr(current_user, 'is_admin') and current_user.is_admin()):
             abort(403)  # облом
         return f(*args, **kwargs)
     return decorated_function
 
+PRINCIPAL_MODELS = {'admin': Admin, 'user': User}
+
 @login_manager.user_loader
-def load_user(user_id):
-    # Пытаемся найти админа или обычного пользователя
-    # Сначала проверяем в таблице админов
-    admin = Admin.query.get(int(user_id))
-    if admin:
-        return admin
-    # Если не найден в админах, ищем в обычных пользователях
-    return User.query.get(int(user_id))
+def load_user(principal_id):
+    """
+    В сессии — 'admin:1' / 'user:1' (см. get_id). Один запрос по первичному ключу,
+    а в течение PRINCIPAL_CACHE_TTL секунд — ни одного: объект берётся из кэша воркера
+    """
+    kind, _, raw_id = principal_id.partition(':')
+    model = PRINCIPAL_MODELS.get(kind)
+    if model is None or not raw_id.isdigit():
+        return None  # старая сессия с голым id — непонятно, админ это или покупатель; пусть войдёт заново
+
+    cached = principal_cache.get(principal_id)
+    if cached is None:
+        cached = db.session.get(model, int(raw_id))
+        if cached is None:
+            return None
+        db.session.expunge(cached)
+        principal_cache.set(principal_id, cached)
+    # копия в сессии этого запроса — без SELECT, но ленивые связи (cart_items) работают
+    return db.session.merge(cached, load=False)
+
+
+def create_app(config=None):
+    """
+    Новое приложение при каждом вызове: умолчания (DEFAULT_CONFIG), поверх — instance/config.py,
+    переменные окружения SHOP_* (SHOP_PAGE_SIZE=48, значения разбираются как JSON) и config.
+    База, кэши и пулы процессов настраиваются здесь, а не при импорте — каждый воркер после fork
+    получает свои. Кэши в памяти и пулы процессов общие на процесс: настройки последнего вызова
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.from_pyfile(os.path.join(basedir, 'instance', 'config.py'), silent=True)
+    app.config.from_prefixed_env('SHOP')
+    app.config.update(config or {})
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = load_secret_key(app.config['SECRET_KEY_FILE'])
+
+    # делаем папки (потом проверить!)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(os.path.join(basedir, 'instance'), exist_ok=True)  # ← важная строка!
+    os.makedirs(app.config['IMAGE_STAGING_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['IMAGE_MANIFEST_FOLDER'], exist_ok=True)
+    image_manifest.configure(app.config['UPLOAD_FOLDER'], app.config['IMAGE_MANIFEST_FOLDER'], SIZES)
+    image_cache.configure(app.config['IMAGE_CACHE_FOLDER'], app.config['IMAGE_CACHE_MAX_BYTES'])
+    if app.config['TEMPLATE_CACHE_FOLDER']:
+        os.makedirs(app.config['TEMPLATE_CACHE_FOLDER'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_FOLDER'])
+    if app.config['TEMPLATES_AUTO_RELOAD'] is not None:
+        app.jinja_env.auto_reload = app.config['TEMPLATES_AUTO_RELOAD']
+    app.extensions['login_limiter'] = create_limiter(app.config['LOGIN_LIMITER_BACKEND'], LOGIN_MAX_ATTEMPTS,
+                                                     LOGIN_WINDOW_SECONDS, app.config['LOGIN_LIMITER_PATH'])
+
+    db.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    with app.app_context():
+        apply_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+        if app.config['SQLITE_READ_POOL']:
+            app.extensions['sqlite_read_engine'] = create_read_engine(
+                db.engine.url.database, app.config['SQLITE_PRAGMAS'],
+                pool_size=app.config['SQLITE_READ_POOL_SIZE'], max_overflow=app.config['SQLITE_READ_POOL_SIZE'],
+                pool_timeout=10, connect_args={'timeout': 5})
+    query_cache.configure(max_entries=app.config['QUERY_CACHE_MAX_ENTRIES'],
+                          max_weight=app.config['QUERY_CACHE_MAX_ROWS'])
+    fragment_cache.configure(max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+                             max_weight=app.config['FRAGMENT_CACHE_MAX_KB'])
+    page_cache.configure(max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'], max_weight=app.config['PAGE_CACHE_MAX_KB'])
+    search_cache.configure(max_entries=app.config['SEARCH_CACHE_MAX_ENTRIES'], ttl=app.config['SEARCH_CACHE_TTL'])
+    principal_cache.configure(ttl=app.config['PRINCIPAL_CACHE_TTL'])
+    passwords.configure(n=app.config['PASSWORD_SCRYPT_N'], r=app.config['PASSWORD_SCRYPT_R'],
+                        p=app.config['PASSWORD_SCRYPT_P'], workers=app.config['PASSWORD_WORKERS'],
+                        queue_size=app.config['PASSWORD_QUEUE_SIZE'], use_pool=app.config['PASSWORD_POOL'])
+    return app
 
-db.init_app(app)
 
 # ===================== ФОРМЫ =====================
 class LoginForm(FlaskForm):
@@ -166,63 +276,243 @@ class ProductForm(FlaskForm):
     is_sale = BooleanField('Распродажа')
     submit = SubmitField('Добавить товар')
 
+# ===================== УСЛОВНЫЕ ЗАПРОСЫ (ETag / 304) =====================
+# ETag страницы считается без рендера: из версий данных и того, что на странице зависит
+# от посетителя. Совпал с If-None-Match — 304 без запросов за товарами и без шаблонов
+_template_stamp = None
+
+
+def _templates_version():
+    """Время изменения самого свежего шаблона — после выкладки новых шаблонов ETag другой"""
+    global _template_stamp
+    if _template_stamp is None:
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        with os.scandir(folder) as entries:
+            _template_stamp = max((e.stat().st_mtime for e in entries if e.is_file()), default=0)
+    return _template_stamp
+
+
+def _viewer_parts():
+    """
+    Что на странице зависит от посетителя: кто вошёл, значок корзины и csrf-токен в формах.
+    Токен подписан со временем и живёт WTF_CSRF_TIME_LIMIT — раз в полсрока ETag меняется,
+    чтобы по 304 не остался HTML с просроченным токеном
+    """
+    user = current_user.get_id() if current_user.is_authenticated else 'anon'
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    return user, cart_count(), session.get('csrf_token', ''), int(time.time() // (limit / 2))
+
+
+def conditional_page(page_parts):
+    """
+    Декоратор для GET-страниц. page_parts(**view_args) -> (от чего зависит содержимое, Last-Modified или None),
+    либо None — тогда страница отдаётся как обычно (например, 404).
+    Сверка идёт только по ETag: Last-Modified не учитывает посетителя и отдаётся для справки
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            page = page_parts(*args, **kwargs)
+            if page is None or session.get('_flashes'):
+                return view(*args, **kwargs)  # сообщения flash показываются один раз — не кэшируем
+            if not session.get('csrf_token'):
+                # токена ещё нет (первый визит, сессию потеряли) — его создаст рендер, а в ETag
+                # попала бы пустая строка: по старому If-None-Match пришёл бы 304 с чужим токеном
+                return view(*args, **kwargs)
+            parts, last_modified = page
+            key = repr((_templates_version(), request.full_path, parts, _viewer_parts()))
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if response.headers.get('X-Page-Cache') == 'STALE':
+                    # прежняя копия из page_cache, а etag — уже от новых данных: по нему
+                    # браузер получил бы 304 и остался со старой страницей
+                    response.cache_control.no_store = True
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # у каждого посетителя своя страница (значок корзины, csrf) — только кэш браузера, с проверкой
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
+
+
+def _catalog_page_parts(*args, **kwargs):
+    # списки товаров (каталог, новинки, поиск) меняются при любой записи в product / category
+    return current_versions()[CATALOG], None
+
+
+def _product_page_parts(product_id):
+    product = _cached_product(product_id)
+    if product is None:
+        return None
+    # страница товара — от самого товара и меню категорий, правки других товаров её не меняют
+    return (product.id, product.updated_at, current_versions()[CATEGORIES]), product.updated_at
+
+# ===================== КЭШ СТРАНИЦ ДЛЯ ГОСТЕЙ =====================
+# Гость, который не вошёл, с пустой корзиной и без сообщений flash, видит то же, что и все гости:
+# готовый HTML берётся из page_cache, в него подставляется только csrf-токен посетителя.
+# Ключ — путь и параметры запроса, которые читает страница; с любыми другими страница не кэшируется.
+# Копия годится, пока не сменились версии данных, от которых она зависит, — их сверяет каждый воркер,
+# так видны и правки из соседнего процесса. Этот воркер после commit ещё и сразу выкидывает
+# затронутые страницы (page_cache.purge по меткам из models.py)
+_GUEST_SESSION_KEYS = {'csrf_token', '_fresh', '_permanent'}
+
+
+def _guest_page_request():
+    return (current_app.config['PAGE_CACHE']
+            and not current_user.is_authenticated
+            and not set(session) - _GUEST_SESSION_KEYS   # нет flash и ничего своего в сессии
+            and not len(guest_cart()))
+
+
+def _cached_page_response(page, status):
+    response = current_app.response_class(page.body.replace(CSRF_PLACEHOLDER, generate_csrf()), mimetype='text/html')
+    response.headers['X-Page-Cache'] = status
+    return response
+
+
+def cached_page(page_versions, args=(), stale_ok=False):
+    """
+    Декоратор для GET-страниц, одинаковых для всех гостей.
+    page_versions(**view_args) -> (версии данных, метки для purge) или None — тогда не кэшируем (например, 404).
+    args — параметры запроса, которые читает страница.
+    stale_ok — горячие страницы: устаревшую копию перерисовывает один поток, остальные тем временем
+    получают её (не дольше PAGE_CACHE_STALE_SECONDS)
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*view_args, **kwargs):
+            if not _guest_page_request() or set(request.args) - set(args):
+                return view(*view_args, **kwargs)
+            page = page_versions(*view_args, **kwargs)
+            if page is None:
+                return view(*view_args, **kwargs)
+            versions, tags = page
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+
+            cached = page_cache.get(key)
+            if (cached is not None and cached.versions == versions
+                    and time.monotonic() - cached.created < current_app.config['PAGE_CACHE_TTL']):
+                return _cached_page_response(cached, 'HIT')
+            stale_seconds = current_app.config['PAGE_CACHE_STALE_SECONDS'] if stale_ok and cached is not None else 0
+            if stale_seconds and not page_cache.claim_refresh(key, stale_seconds):
+                return _cached_page_response(cached, 'STALE')
+
+            try:
+                response = make_response(view(*view_args, **kwargs))
+                if response.status_code == 200 and response.mimetype == 'text/html' and not session.get('_flashes'):
+                    data = response.get_data()
+                    # меню категорий есть на каждой странице
+                    page_cache.set(key, CachedPage(data.decode().replace(generate_csrf(), CSRF_PLACEHOLDER), versions,
+                                                   frozenset(tags) | {'categories'}, time.monotonic(), stale_ok),
+                                   weight=len(data) // 1024 + 1)
+                    response.headers['X-Page-Cache'] = 'MISS'
+            finally:
+                if stale_seconds:
+                    page_cache.release_refresh(key)
+            return response
+        return wrapped
+    return decorator
+
+
+def _site_page_versions(*args, **kwargs):
+    # главная и «О нас»: из данных — только меню категорий
+    return (current_versions()[CATEGORIES],), ()
+
+
+def _catalog_page_versions(*args, **kwargs):
+    return (current_versions()[CATALOG],), ('catalog',)
+
+
+def _product_page_versions(product_id):
+    product = _cached_product(product_id)
+    if product is None:
+        return None
+    return (product.updated_at, current_versions()[CATEGORIES]), (f'product:{product_id}',)
+
+
 # ===================== МАРШРУТЫ =====================
-@app.route("/")
+@bp.route("/")
+@cached_page(_site_page_versions, stale_ok=True)
 def index():
     return render_template("index.html")
 
-@app.route("/catalog")
+@bp.route("/catalog")
+@conditional_page(_catalog_page_parts)
+@cached_page(_catalog_page_versions, args=('category', 'new', 'sale', 'cursor', 'per_page', 'fragment'),
+             stale_ok=True)
 def catalog():
     # Получаем параметры из URL
     category_slug = request.args.get('category')
     show_new = request.args.get('new') == 'true'
     show_sale = request.args.get('sale') == 'true'
+    cursor = request.args.get('cursor')
+    page_size = _page_size()
+
+    def load():
+        # базовый запрос
+        query = Product.query
+
+        # фильтр по категории
+        if category_slug:
+            category = Category.query.filter_by(slug=category_slug).first_or_404()
+            query = query.filter_by(category_id=category.id)
+            current_category = category
+        else:
+            current_category = None
 
-    # базовый запрос
-    query = Product.query
-
-    # фильтр по категории
-    if category_slug:
-        category = Category.query.filter_by(slug=category_slug).first_or_404()
-        query = query.filter_by(category_id=category.id)
-        current_category = category
-    else:
-        current_category = None
-
-    # Фильтр "Новинки"
-    if show_new:
-        query = query.filter_by(is_new=True)
+        # Фильтр "Новинки"
+        if show_new:
+            query = query.filter_by(is_new=True)
 
-    # Фильтр "Распродажа"
-    if show_sale:
-        query = query.filter_by(is_sale=True)
+        # Фильтр "Распродажа"
+        if show_sale:
+            query = query.filter_by(is_sale=True)
 
-    # Сортировка сначала по новизне , иначе по дате добавления
-    if show_new:
-        query = query.order_by(Product.created_at.desc())
-    else:
-        query = query.order_by(Product.created_at.desc())
+        # одна страница, сортировка по дате добавления (новые сверху)
+        products, next_cursor = keyset_page(query, PRODUCT_ORDER, cursor, page_size, _product_key)
+        return _cache_value((products, next_cursor, current_category), products, current_category)
 
-    
-    products = query.all()
+    products, next_cursor, current_category = query_cache.get_or_load(
+        _cache_key('catalog', category_slug, show_new, show_sale, cursor, page_size), load
+    )
 
     # Передаём в шаблон
-    return render_template(
+    return _render_product_page(
         "catalog.html",
-        products=products,
+        products,
+        next_cursor,
         current_category=current_category,  # можно использовать в шаблоне
         novelties=show_new  #  уже есть это условие
     )
 
 
-@app.route('/novelties')
+@bp.route('/novelties')
+@conditional_page(_catalog_page_parts)
+@cached_page(_catalog_page_versions, args=('cursor', 'per_page', 'fragment'), stale_ok=True)
 def novelties():
-    products = Product.query.order_by(Product.created_at.desc()).limit(10).all()
-    return render_template('catalog.html', products=products, novelties=True)
-@app.route("/register", methods=["GET", "POST"])
+    cursor = request.args.get('cursor')
+    page_size = _page_size(current_app.config['NOVELTIES_PAGE_SIZE'])
+
+    def load():
+        products, next_cursor = keyset_page(Product.query, PRODUCT_ORDER, cursor, page_size, _product_key)
+        return _cache_value((products, next_cursor), products)
+
+    products, next_cursor = query_cache.get_or_load(_cache_key('novelties', cursor, page_size), load)
+    return _render_product_page('catalog.html', products, next_cursor, novelties=True)
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('shop.index'))
     form = RegisterForm()
     if form.validate_on_submit():
         user = User(
@@ -231,31 +521,36 @@ def register():
             full_name=form.full_name.data,
             phone=form.phone.data
         )
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy as e:
+            flash(str(e), "error")
+            return render_template('register.html', form=form)
         db.session.add(user)
         db.session.commit()
         flash('Регистрация прошла успешно! Теперь вы можете войти.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('shop.login'))
     return render_template('register.html', form=form)
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if current_user.is_authenticated:
         if isinstance(current_user, Admin):
             return redirect("/admin")
-        return redirect(url_for('index'))
+        return redirect(url_for('shop.index'))
 
     form = UserLoginForm()  #  вместо LoginForm
     ip = request.remote_addr or 'unknown'
 
     if form.validate_on_submit():
         username = (form.username.data or '').strip()
+        login_limiter = current_app.extensions['login_limiter']
 
         # Проверяем блокировку
         ip_key = f"ip:{ip}"
         user_key = f"user:{username}"
-        if _is_blocked(ip_key) or _is_blocked(user_key):
-            rem = max(_remaining_block_seconds(ip_key), _remaining_block_seconds(user_key))
+        if login_limiter.is_blocked(ip_key) or login_limiter.is_blocked(user_key):
+            rem = max(login_limiter.retry_after(ip_key), login_limiter.retry_after(user_key))
             flash(f"Слишком много попыток входа. Попробуйте через {rem} секунд.", "error")
             return render_template("login.html", form=form)
 
@@ -264,24 +559,30 @@ def login():
         if not user:
             user = User.query.filter(or_(User.username == username, User.email == username)).first()
 
-        if user and user.check_password(form.password.data):
+        try:
+            ok = user is not None and user.check_password(form.password.data)
+            if ok and needs_rehash(user.password_hash):
+                # поменялась стоимость scrypt — пересчитываем хэш, пока пароль под рукой
+                user.set_password(form.password.data)
+                db.session.commit()
+        except PasswordHasherBusy as e:
+            flash(str(e), "error")
+            return render_template("login.html", form=form)
+
+        if ok:
             #  очищаем счётчики(если получилось)
-            with _attempts_lock:
-                _login_attempts.pop(ip_key, None)
-                _login_attempts.pop(user_key, None)
+            login_limiter.reset(ip_key)
+            login_limiter.reset(user_key)
             login_user(user, remember=True)
 
             if isinstance(user, Admin):
                 return redirect("/admin")
-            return redirect(url_for('index'))
+            if _merge_guest_cart(user.id):
+                flash("Товары, добавленные до входа, перенесены в вашу корзину", "info")
+            return redirect(url_for('shop.index'))
 
         # неудачная попытка
-        _record_failed(ip_key)
-        _record_failed(user_key)
-        attempts_left = min(
-            max(0, LOGIN_MAX_ATTEMPTS - _prune_attempts(ip_key)),
-            max(0, LOGIN_MAX_ATTEMPTS - _prune_attempts(user_key))
-        )
+        attempts_left = min(login_limiter.hit(ip_key), login_limiter.hit(user_key))
 
         if attempts_left <= 0:
             flash("Слишком много попыток входа. Попробуйте позже.", "error")
@@ -294,11 +595,11 @@ def login():
 
 
 
-@app.route("/profile")
+@bp.route("/profile")
 @login_required
 def profile():
     if hasattr(current_user, 'is_admin') and current_user.is_admin():
-        return redirect(url_for('admin_panel'))
+        return redirect(url_for('shop.admin_panel'))
 
     # Получаем информацию о пользователе и его заказы/покупки
     user = current_user
@@ -308,17 +609,17 @@ def profile():
 
 
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
     return redirect("/")
 
-@app.route("/admin", methods=["GET", "POST"])
+@bp.route("/admin", methods=["GET", "POST"])
 @admin_required
 def admin_panel():
     form = ProductForm()
-    form.category.choices = [(c.id, c.name) for c in Category.query.order_by(Category.order).all()]
+    form.category.choices = [(c.id, c.name) for c in get_categories()]
 
     # Обработка отправки формы вне зависимости от валидации
     if request.method == "POST":
@@ -326,7 +627,11 @@ def admin_panel():
         # обработка фото — если загружено новое
         if form.image.data:
             print("Загружено изображение:", form.image.data.filename)
-            image_filename = process_product_image(form.image.data)
+            try:
+                image_filename = process_product_image(form.image.data)
+            except ValueError as e:
+                flash(str(e), "error")
+                return redirect(url_for("shop.admin_panel"))
         else:
             print("Изображение не выбрано, используем placeholder")
             image_filename = "placeholder.jpg"  # если фото не выбрано
@@ -347,7 +652,11 @@ def admin_panel():
             category_id=category_id,
             is_new=form.is_new.data,
             is_sale=form.is_sale.data,
-            sizes=form.sizes.data
+            sizes=form.sizes.data,
+            tags=form.tags.data or "",
+            brand=form.brand.data or None,
+            color=form.color.data or None,
+            sku=form.sku.data or None
         )
         print("Добавляем товар в сессию")
         db.session.add(product)
@@ -355,7 +664,7 @@ def admin_panel():
         db.session.commit()
         print(f"Товар «{product.title}» успешно добавлен!")
         flash(f"Товар «{product.title}» успешно добавлен!", "success")
-        return redirect(url_for("admin_products"))
+        return redirect(url_for("shop.admin_products"))
     else:
         # форма не прошла валидацию -- показать ошибки
         if form.errors:
@@ -365,47 +674,59 @@ def admin_panel():
     products = Product.query.order_by(Product.created_at.desc()).all()
     return render_template("admin_panel.html", form=form, products=products)
 
-@app.route("/admin/delete/<int:product_id>", methods=["POST"])
+@bp.route("/admin/delete/<int:product_id>", methods=["POST"])
 @admin_required
 def delete_product(product_id):
     try:
         product = Product.query.get_or_404(product_id)
-        # Используем правильное имя placeholder!
-        if product.image != "placeholder.jpg":
-            # Удаляем все три размера изображения.
-            base_name = product.image.replace("_thumb.jpg", "")
-            for suffix in ["thumb", "medium", "full"]:
-                try:
-                    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], f"{base_name}_{suffix}.jpg"))
-                except:
-                    pass
         db.session.delete(product)
         db.session.commit()
+        # файлы — только после commit и только если фото больше ни у кого нет
+        release_product_image(product.image)
         flash(f"Товар «{product.title}» удалён", "info")
     except Exception as e:
         flash(f"Ошибка при удалении товара: {str(e)}", "error")
-        return redirect(url_for("admin_products"))
-    return redirect(url_for("admin_products"))
-@app.route("/admin/products")
+        return redirect(url_for("shop.admin_products"))
+    return redirect(url_for("shop.admin_products"))
+@bp.route("/admin/products")
 @admin_required
 def admin_products():
     products = Product.query.order_by(Product.created_at.desc()).all()
-    return render_template("admin_products.html", products=products)
+    return render_template("admin_products.html", products=products, image_status=image_status)
+
+
+@bp.route("/admin/image-status/<image_name>")
+@admin_required
+def image_processing_status(image_name):
+    # админка опрашивает, готовы ли размеры загруженного фото
+    return jsonify(status=image_status(secure_filename(image_name)))
 
 
-@app.route("/admin/edit/<int:product_id>", methods=["GET", "POST"])
+@bp.route("/admin/cache-stats")
+@admin_required
+def cache_stats():
+    # счётчики попаданий/промахов — чтобы подобрать размер кэша
+    return jsonify({**query_cache.stats(), "fragment_cache": fragment_cache.stats(),
+                    "page_cache": page_cache.stats(), "image_cache": image_cache.stats()})
+
+
+@bp.route("/admin/edit/<int:product_id>", methods=["GET", "POST"])
 @admin_required
 def edit_product(product_id):
     product = Product.query.get_or_404(product_id)
     form = ProductForm(obj=product)  # заполняем форму текущими данными
-    form.category.choices = [(c.id, c.name) for c in Category.query.order_by(Category.order).all()]
+    form.category.choices = [(c.id, c.name) for c in get_categories()]
 
     if form.validate_on_submit():
         old_image = product.image  # запоминаем старо
        
         # если загружено новое фото — обработать, иначе оставляем старое
         if form.image.data:
-            image_filename = process_product_image(form.image.data, delete_old_image=old_image)
+            try:
+                image_filename = process_product_image(form.image.data)
+            except ValueError as e:
+                flash(str(e), "error")
+                return redirect(url_for("shop.edit_product", product_id=product.id))
             product.image = image_filename
         # иначе image остаётся прежним — ничего не трогать не надо
 
@@ -418,133 +739,413 @@ def edit_product(product_id):
         product.is_new = form.is_new.data
         product.is_sale = form.is_sale.data
         product.sizes = form.sizes.data
+        product.tags = form.tags.data or ""
+        product.brand = form.brand.data or None
+        product.color = form.color.data or None
+        product.sku = form.sku.data or None
     
         db.session.commit()
+        if product.image != old_image:
+            release_product_image(old_image)
         flash("Товар обновлён!", "success")
         return redirect("/admin/products")
     return render_template("admin_edit.html", form=form, product=product)
 
-@app.errorhandler(403)
+@bp.app_errorhandler(403)
 def forbidden(error):
     return render_template('403.html'), 403
 
 import os
 
 #   ===================== вспом. функции =================
+def release_product_image(image_name):
+    """
+    Фото хранятся по хэшу содержимого и бывают общими у нескольких товаров:
+    файлы удаляются, когда на них не ссылается ни одна строка product
+    """
+    if not image_name or image_name == "placeholder.jpg":
+        return
+    if db.session.query(Product.query.filter_by(image=image_name).exists()).scalar():
+        return
+    delete_product_images(image_name)
+
+def _image_base(base_image_name):
+    """'<base>_thumb.jpg' -> '<base>'; None для placeholder и чужих имён"""
+    if not base_image_name or base_image_name == "placeholder.jpg" or not base_image_name.endswith('_thumb.jpg'):
+        return None
+    return base_image_name[:-len('_thumb.jpg')]
+
+
 def get_image_path(base_image_name, size_suffix):
     """
-    Возвращает путь к изображению нужного размера, проверяя его существование
+    Возвращает путь к изображению нужного размера — по манифесту вариантов, без обращений к диску
     """
-    if not base_image_name or base_image_name == "placeholder.jpg":
+    base_name = _image_base(base_image_name)
+    if base_name is None:
         return base_image_name
 
-    # Получить имя файла
-    if base_image_name.endswith('_thumb.jpg'):
-        base_name = base_image_name.replace('_thumb.jpg', '')
-    else:
-        # если это не thumb-файл, то как есть
-        base_name = base_image_name.replace('.jpg', '')
+    variants = image_manifest.get(base_name) or {}
+    variant = variants.get((size_suffix, 'jpeg'))
+    if variant:
+        return variant['file']
+    # нужного размера нет (или фото ещё в обработке) — отдаём thumb из БД
+    return base_image_name
 
-    # Формируем имя файла нужного размера
-    target_filename = f"{base_name}_{size_suffix}.jpg"
+def product_image_sources(base_image_name):
+    """
+    srcset для <picture>: {'jpeg': '..._thumb.jpg 300w, ..._medium.jpg 600w, ...', 'webp': ..., 'avif': ...}
+    Формат попадает сюда, только если он есть в манифесте. None — для placeholder и необработанных фото
+    """
+    base_name = _image_base(base_image_name)
+    variants = image_manifest.get(base_name) if base_name else None
+    if not variants:
+        return None
 
-    # Проверить, существует ли файл в папке загрузки
-    upload_folder = app.config['UPLOAD_FOLDER']
-    full_path = os.path.join(upload_folder, target_filename)
+    by_format = {}
+    for suffix in reversed(SIZES):
+        for (size, fmt), variant in variants.items():
+            if size == suffix:
+                by_format.setdefault(fmt, []).append(
+                    f"{url_for('static', filename='images/products/' + variant['file'])} {variant['width']}w"
+                )
+    return {fmt: ", ".join(items) for fmt, items in by_format.items()}
+
+# ===================== СТРАНИЦЫ ТОВАРОВ =====================
+# каталог, новинки и поиск листаются курсором по (created_at, id) — без OFFSET и без query.all()
+PRODUCT_ORDER = [(Product.created_at, True), (Product.id, True)]
+
+
+def _product_key(product):
+    return [product.created_at, product.id]
 
-    # Если файл существует, то вернем его имя, иначе возвращаем оригинальное
-    if os.path.exists(full_path):
-        return target_filename
-    else:
-        # Если файл нужного размера не существует, возвращаем оригинальное имя
-        # или возвращаем thumb, если запрашиваемый размер не thumb
-        if size_suffix != 'thumb' and base_image_name.endswith('_thumb.jpg'):
-            return base_image_name  # возвращаем thumb, если запрашиваемый размер отсутствует
-        return base_image_name
+
+def _page_size(default=None):
+    """Размер страницы: из ?per_page= (с потолком) или из конфига"""
+    size = default or current_app.config['PAGE_SIZE']
+    try:
+        size = int(request.args.get('per_page', size))
+    except (ValueError, TypeError):
+        pass
+    return max(1, min(size, current_app.config['MAX_PAGE_SIZE']))
+
+
+def _page_url(cursor, url_args=None, **extra):
+    """Ссылка на следующую страницу с теми же фильтрами"""
+    args = request.args.to_dict()
+    args.pop('fragment', None)
+    args.update(url_args or {})
+    args.update(extra)
+    args['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def _cache_value(value, products, *others):
+    """
+    (value, вес) для query_cache. Объекты отцепляем от сессии запроса —
+    они живут в кэше дольше запроса и используются только для чтения
+    """
+    for obj in [*products, *others]:
+        if obj is not None and obj in db.session:
+            db.session.expunge(obj)
+    return value, len(products) + 1
+
+
+def _render_product_page(template, products, next_cursor, url_args=None, **context):
+    """
+    Полная страница или, при ?fragment=1, только карточки + ссылка «Показать ещё»
+    (её подгружает main.js при бесконечной прокрутке)
+    """
+    next_url = _page_url(next_cursor, url_args) if next_cursor else None
+    next_fragment_url = _page_url(next_cursor, url_args, fragment=1) if next_cursor else None
+    if request.args.get('fragment'):
+        return render_template('product_page.html', products=products,
+                               next_url=next_url, next_fragment_url=next_fragment_url)
+    return render_template(template, products=products, next_url=next_url,
+                           next_fragment_url=next_fragment_url, **context)
+
+# ===================== КАРТОЧКИ ТОВАРОВ =====================
+# готовый HTML карточки живёт в fragment_cache. Ключ: id товара, его updated_at
+# и нарезано ли уже фото (до этого в карточке нет srcset) — правка одного товара не сбрасывает остальные.
+# csrf_token у каждой сессии свой, поэтому в кэше вместо него метка — подставляется в готовый HTML
+CSRF_PLACEHOLDER = '__csrf_token__'
+
+
+def _card_html(product):
+    base_name = _image_base(product.image)
+    key = ('card', product.id, product.updated_at, bool(base_name and image_manifest.get(base_name)))
+    html = fragment_cache.get(key)
+    if html is None:
+        html = current_app.jinja_env.get_template('product_card.html').render(
+            product=product, get_image_path=get_image_path, product_image_sources=product_image_sources,
+            csrf_token=lambda: CSRF_PLACEHOLDER,
+        )
+        fragment_cache.set(key, html, weight=len(html) // 1024 + 1)
+    return html
+
+
+def product_cards(products):
+    """HTML карточек страницы (каталог, поиск, новинки) — из кэша, с csrf-токеном этой сессии"""
+    html = ''.join(_card_html(product) for product in products)
+    return Markup(html.replace(CSRF_PLACEHOLDER, generate_csrf()))
 
 # ===================== КОНТЕКСТНЫЙ ПРОЦЕССОР =====================
 # Делает переменную categories доступной ВО ВСЕХ шаблонах автоматически
-@app.context_processor
+@bp.app_context_processor
 def inject_categories():
     """
     Добавляет в каждый шаблон список категорий из базы.
     Теперь можно использовать {{ categories }} и Category в любом .html
     """
+    return dict(categories=get_categories(), get_image_path=get_image_path,
+                product_image_sources=product_image_sources, cart_count=cart_count,
+                product_cards=product_cards)
+
+
+def cart_count():
+    """Значок корзины в шапке: один COUNT за запрос (и только если шаблон его показывает)"""
+    if not current_user.is_authenticated:
+        return len(guest_cart())  # из cookie, без запроса к базе
+    if current_user.is_admin():
+        return 0
+    if 'cart_count' not in g:
+        g.cart_count = (db.session.query(func.count(CartItem.id))
+                        .filter(CartItem.user_id == current_user.id).scalar())
+    return g.cart_count
+
+
+# ===================== ВЕРСИИ ДАННЫХ =====================
+# cache_version в базе общая для всех воркеров: кто-то поменял категорию или товар —
+# версия выросла, и кэши в каждом процессе это увидят на следующем запросе
+def current_versions():
+    """Версии из cache_version — читаются один раз за запрос"""
+    if 'cache_versions' not in g:
+        g.cache_versions = read_versions(db.session.connection())
+    return g.cache_versions
+
+
+def _load_categories():
     categories = Category.query.order_by(Category.order).all()
-    return dict(categories=categories, get_image_path=get_image_path)
+    for category in categories:
+        db.session.expunge(category)  # живут дольше запроса, только для чтения
+    return tuple(categories)
+
+
+_categories_snapshot = VersionedSnapshot(_load_categories)
+
+
+def get_categories():
+    """Список категорий из памяти; перечитывается из базы только после изменения категорий"""
+    return _categories_snapshot.get(current_versions()[CATEGORIES])
+
+
+def _cache_key(*parts):
+    # версия каталога в ключе: после записи в другом воркере старые записи просто не найдутся
+    return (current_versions()[CATALOG],) + parts
 
 # ===================== КОРЗИНА =====================
-@app.route("/cart")
-@login_required
+@bp.route("/cart")
 def cart():
-    # Получаем все товары пользователя из корзины
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    if not current_user.is_authenticated:
+        return _guest_cart_page()
+
+    # Одним запросом: позиции корзины вместе с товарами, сумма по строке и общая (оконная) сумма
+    line_total = CartItem.quantity * Product.price
+    rows = (
+        db.session.query(CartItem, line_total.label('line_total'), func.sum(line_total).over().label('cart_total'))
+        .join(CartItem.product)
+        .options(contains_eager(CartItem.product))
+        .filter(CartItem.user_id == current_user.id)
+        .order_by(CartItem.added_at, CartItem.id)
+        .all()
+    )
 
     # если корзина пуста, показывать пустую корзину
-    if not cart_items:
+    if not rows:
         return render_template("cart.html", cart_items=[], total=0)
 
-    # Рассчитываем общую сумму
-    total = sum(item.product.price * item.quantity for item in cart_items)
-
+    cart_items = [
+        (item, line, dict(update=url_for('shop.update_cart_item', cart_item_id=item.id),
+                          remove=url_for('shop.remove_from_cart', cart_item_id=item.id),
+                          api=url_for('shop.api_cart_item', item_id=item.id)))
+        for item, line, _ in rows
+    ]
+    return render_template("cart.html", cart_items=cart_items, total=rows[0].cart_total)
+
+# ===================== корзина гостя =====================
+# до входа корзина живёт в подписанной cookie (utils/guest_cart.py): просмотр и покупки гостя
+# не пишут в базу; при входе всё переносится в cart_item одним INSERT ... ON CONFLICT
+GuestCartLine = namedtuple('GuestCartLine', 'product size quantity')
+
+def guest_cart():
+    """Корзина гостя из cookie — разбирается один раз за запрос"""
+    if 'guest_cart' not in g:
+        g.guest_cart = load_guest_cart(request.cookies.get(GUEST_CART_COOKIE), current_app.secret_key)
+    return g.guest_cart
+
+@bp.after_app_request
+def save_guest_cart(response):
+    cart = g.get('guest_cart')
+    if cart is not None and cart.changed:
+        if len(cart):
+            response.set_cookie(GUEST_CART_COOKIE, dump_guest_cart(cart, current_app.secret_key),
+                                max_age=current_app.config['GUEST_CART_MAX_AGE'], httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(GUEST_CART_COOKIE)
+        cart.changed = False
+    return response
+
+def _guest_cart_page():
+    cart = guest_cart()
+    ids = {product_id for product_id, _, _ in cart}
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))} if ids else {}
+
+    cart_items = []
+    for product_id, size, quantity in cart:
+        product = products.get(product_id)
+        if product is None:
+            continue  # товар успели удалить
+        cart_items.append((
+            GuestCartLine(product, size, quantity), product.price * quantity,
+            dict(update=url_for('shop.guest_cart_update', product_id=product_id, size=size),
+                 remove=url_for('shop.guest_cart_remove', product_id=product_id, size=size),
+                 api=url_for('shop.api_guest_cart_item', product_id=product_id, size=size)),
+        ))
+    total = sum(line for _, line, _ in cart_items)
     return render_template("cart.html", cart_items=cart_items, total=total)
 
-@app.route("/cart/add/<int:product_id>", methods=["POST", "GET"])
-@login_required
+def _merge_guest_cart(user_id):
+    """Переносит корзину гостя в базу после входа. Возвращает число перенесённых позиций"""
+    cart = guest_cart()
+    if not len(cart):
+        return 0
+    existing = {pid for pid, in db.session.query(Product.id).filter(Product.id.in_({pid for pid, _, _ in cart}))}
+    items = [line for line in cart if line[0] in existing]
+    merge_items(user_id, items)
+    db.session.commit()
+    cart.clear()
+    return len(items)
+
+@bp.route("/cart/guest/<int:product_id>/update", methods=["POST"])
+def guest_cart_update(product_id):
+    try:
+        quantity = int(request.form.get("quantity", 1))
+    except ValueError:
+        quantity = 1
+    if guest_cart().set(product_id, request.args.get('size', ''), quantity):
+        flash("Корзина обновлена", "success" if quantity > 0 else "info")
+    return redirect(url_for("shop.cart"))
+
+@bp.route("/cart/guest/<int:product_id>/remove", methods=["POST"])
+def guest_cart_remove(product_id):
+    if guest_cart().set(product_id, request.args.get('size', ''), 0):
+        flash("Товар удалён из корзины", "info")
+    return redirect(url_for("shop.cart"))
+
+def _size_error(product, size):
+    """Текст ошибки, если размер не подходит товару, иначе None"""
+    if not product.sizes:  # у товара нет размеров — выбирать нечего
+        return None
+    if not size:
+        return f"Пожалуйста, выберите размер для товара «{product.title}»"
+    available_sizes = [s.strip() for s in product.sizes.split(',')]
+    if size not in available_sizes:
+        return f"Размер {size} недоступен для этого товара"
+    return None
+
+def _added_message(product, size, quantity):
+    size_text = f" (размер {size})" if size else ""
+    if quantity > 1:
+        return f"Товар «{product.title}»{size_text} уже в корзине. Количество увеличено до {quantity} шт.", "info"
+    return f"Товар «{product.title}»{size_text} добавлен в корзину!", "success"
+
+def _add_one(product_id, size):
+    """+1 к позиции: в базе для вошедшего, в cookie для гостя. (id позиции или None, новое количество)"""
+    if current_user.is_authenticated:
+        # один INSERT ... ON CONFLICT: двойной клик не создаст вторую строку
+        (item_id, quantity), = add_items(current_user.id, [(product_id, size, 1)])
+        db.session.commit()
+        return item_id, quantity
+    return None, guest_cart().add(product_id, size)
+
+@bp.route("/cart/add/<int:product_id>", methods=["POST", "GET"])
 def add_to_cart(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = _cached_product(product_id)
+    if product is None:
+        abort(404)
 
     # Получаем размер из формы
-    size = request.form.get('size') if request.method == 'POST' else None
+    size = (request.form.get('size') if request.method == 'POST' else None) or ''
 
     # Проверяем, что если у товара есть размеры, то пользователь выбрал один из них
-    if product.sizes:  # Если у товара есть доступные размеры
-        if not size:  # Если размер не выбран
-            flash(f"Пожалуйста, выберите размер для товара «{product.title}»", "error")
-            return redirect(request.referrer or url_for('catalog'))
-
-        # Проверяем, что размер доступен для этого товара
-        available_sizes = [s.strip() for s in product.sizes.split(',')]
-        if size not in available_sizes:
-            flash(f"Размер {size} недоступен для этого товара", "error")
-            return redirect(request.referrer or url_for('catalog'))
-
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id,
-        product_id=product_id,
-        size=size
-    ).first()
-
-    if cart_item:
-        # Товар уже есть — увеличиваем количество и показываем сообщение
-        cart_item.quantity += 1
-        db.session.commit()
-        size_text = f" (размер {size})" if size else ""
-        flash(f"Товар «{product.title}»{size_text} уже в корзине. Количество увеличено до {cart_item.quantity} шт.", "info")
-    else:
-        # Новый товар
-        cart_item = CartItem(
-            user_id=current_user.id,
-            product_id=product_id,
-            size=size,
-            quantity=1
-        )
-        db.session.add(cart_item)
-        db.session.commit()
-        size_text = f" (размер {size})" if size else ""
-        flash(f"Товар «{product.title}»{size_text} добавлен в корзину!", "success")
+    error = _size_error(product, size)
+    if error:
+        flash(error, "error")
+        return redirect(request.referrer or url_for('shop.catalog'))
+
+    try:
+        _, quantity = _add_one(product_id, size)
+    except GuestCartFull as e:
+        flash(str(e), "error")
+        return redirect(request.referrer or url_for('shop.catalog'))
+    flash(*_added_message(product, size, quantity))
 
     # Остаёмся на той же странице 
-    return redirect(request.referrer or url_for('catalog'))
+    return redirect(request.referrer or url_for('shop.catalog'))
+
+@bp.route("/cart/batch/add", methods=["POST"])
+@login_required
+def add_to_cart_batch():
+    """
+    Несколько товаров одной транзакцией:
+    {"items": [{"product_id": 3, "size": "M", "quantity": 2}, ...]}.
+    Если хоть одна позиция не подходит — не добавляется ничего
+    """
+    try:
+        items = [(int(i['product_id']), str(i.get('size') or ''), int(i.get('quantity', 1)))
+                 for i in (request.get_json(silent=True) or {}).get('items', [])]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return jsonify(error="Неверный формат запроса"), 400
+    if not items or any(quantity <= 0 for _, _, quantity in items):
+        return jsonify(error="Неверный формат запроса"), 400
+
+    products = {p.id: p for p in Product.query.filter(Product.id.in_({pid for pid, _, _ in items}))}
+    for product_id, size, _ in items:
+        product = products.get(product_id)
+        error = _size_error(product, size) if product else f"Товар {product_id} не найден"
+        if error:
+            return jsonify(error=error), 400
+
+    added = add_items(current_user.id, items)
+    db.session.commit()
+    g.pop('cart_count', None)  # значок считаем уже по новой корзине
+    return jsonify(quantities=[quantity for _, quantity in added], count=cart_count())
 
-@app.route("/cart/update/<int:cart_item_id>", methods=["POST"])
+@bp.route("/cart/batch/update", methods=["POST"])
+@login_required
+def update_cart_batch():
+    """
+    Новые количества нескольких позиций одной транзакцией: {"items": [{"id": 12, "quantity": 3}, ...]};
+    количество 0 — удалить позицию
+    """
+    try:
+        updates = {int(i['id']): int(i['quantity'])
+                   for i in (request.get_json(silent=True) or {}).get('items', [])}
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return jsonify(error="Неверный формат запроса"), 400
+
+    changed = set_quantities(current_user.id, updates)
+    db.session.commit()
+    g.pop('cart_count', None)  # значок считаем уже по новой корзине
+    return jsonify(changed=changed, count=cart_count())
+
+@bp.route("/cart/update/<int:cart_item_id>", methods=["POST"])
 @login_required
 def update_cart_item(cart_item_id):
     cart_item = CartItem.query.get_or_404(cart_item_id)
 
     if cart_item.user_id != current_user.id:
         flash("У вас нет прав на изменение этой корзины", "error")
-        return redirect(url_for("cart"))
+        return redirect(url_for("shop.cart"))
 
     quantity = int(request.form.get("quantity", 1))
 
@@ -558,9 +1159,9 @@ def update_cart_item(cart_item_id):
         flash(f"Количество товара «{cart_item.product.title}»{size_text} обновлено: {quantity} шт.", "success")
 
     db.session.commit()
-    return redirect(url_for("cart"))
+    return redirect(url_for("shop.cart"))
 
-@app.route("/cart/remove/<int:cart_item_id>", methods=["POST"])
+@bp.route("/cart/remove/<int:cart_item_id>", methods=["POST"])
 @login_required
 def remove_from_cart(cart_item_id):
     cart_item = CartItem.query.get_or_404(cart_item_id)
@@ -568,99 +1169,406 @@ def remove_from_cart(cart_item_id):
     # Проверить что товар принадлежит текущему пользователю
     if cart_item.user_id != current_user.id:
         flash("У вас нет прав на удаление из этой корзины", "error")
-        return redirect(url_for("cart"))
+        return redirect(url_for("shop.cart"))
 
     product_title = cart_item.product.title
     size_text = f" (размер {cart_item.size})" if cart_item.size else ""
     db.session.delete(cart_item)
     db.session.commit()
     flash(f"Товар «{product_title}»{size_text} удален из корзины", "info")
-    return redirect(url_for("cart"))
+    return redirect(url_for("shop.cart"))
+
+# ===================== JSON API корзины =====================
+# то же, что формы выше, но без редиректа и перерисовки всей страницы:
+# в ответе — изменённая строка, новые итоги и число позиций для значка (static/js/cart.js, main.js)
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify(error="Войдите, чтобы пользоваться корзиной"), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _cart_response(item_id, **extra):
+    count, total = cart_summary(current_user.id)
+    return jsonify(line=cart_line(current_user.id, item_id), count=count, total=total, **extra)
+
+def _guest_cart_response(product_id, size, **extra):
+    """Ответ API для гостя: цены — из кэша товаров, сама корзина — из cookie"""
+    cart = guest_cart()
+    total = 0
+    for pid, _, quantity in cart:
+        product = _cached_product(pid)
+        total += product.price * quantity if product else 0
+    quantity = cart.get(product_id, size)
+    product = _cached_product(product_id)
+    line = None
+    if quantity and product:  # товар могли удалить, а в cookie он остался
+        price = product.price
+        line = dict(id=None, product_id=product_id, size=size, quantity=quantity,
+                    price=price, line_total=price * quantity)
+    return jsonify(line=line, count=len(cart), total=total, **extra)
+
+def _requested_quantity():
+    """quantity из JSON-тела; None, если его нет или оно не число"""
+    try:
+        return int((request.get_json(silent=True) or {})['quantity'])
+    except (TypeError, ValueError, KeyError):
+        return None
+
+@bp.route("/api/cart/add/<int:product_id>", methods=["POST"])
+def api_cart_add(product_id):
+    product = _cached_product(product_id)
+    if product is None:
+        return jsonify(error="Товар не найден"), 404
+    data = request.get_json(silent=True) or request.form
+    size = data.get('size') or ''
+    error = _size_error(product, size)
+    if error:
+        return jsonify(error=error), 400
+
+    try:
+        item_id, quantity = _add_one(product_id, size)
+    except GuestCartFull as e:
+        return jsonify(error=str(e)), 400
+    message, category = _added_message(product, size, quantity)
+    if item_id is None:
+        return _guest_cart_response(product_id, size, message=message, category=category)
+    return _cart_response(item_id, message=message, category=category)
+
+@bp.route("/api/cart/items/<int:item_id>", methods=["POST", "DELETE"])
+@api_login_required
+def api_cart_item(item_id):
+    """POST {"quantity": 3} — новое количество (0 — удалить), DELETE — удалить позицию"""
+    quantity = 0 if request.method == "DELETE" else _requested_quantity()
+    if quantity is None:
+        return jsonify(error="Неверное количество"), 400
+
+    if not set_quantities(current_user.id, {item_id: quantity}):
+        return jsonify(error="Позиция не найдена"), 404
+    db.session.commit()
+    return _cart_response(item_id)
+
+@bp.route("/api/cart/guest/<int:product_id>", methods=["POST", "DELETE"])
+def api_guest_cart_item(product_id):
+    """То же для корзины гостя; позиция — товар + ?size="""
+    quantity = 0 if request.method == "DELETE" else _requested_quantity()
+    if quantity is None:
+        return jsonify(error="Неверное количество"), 400
+    size = request.args.get('size', '')
+    if not guest_cart().set(product_id, size, quantity):
+        return jsonify(error="Позиция не найдена"), 404
+    return _guest_cart_response(product_id, size)
 
 # =====    поиск   =====================
-@app.route('/search')
+@bp.route('/search')
+@conditional_page(_catalog_page_parts)
 def search():
     q = request.args.get('q', '').strip()
-    category_slug = request.args.get('category')
-    min_price = request.args.get('min_price')
-    max_price = request.args.get('max_price')
-    new = request.args.get('new')
-    sale = request.args.get('sale')
+    params = _search_params()
+
+    # список id по этим параметрам — один на поколение каталога; старое поколение — собираем заново
+    generation = current_versions()[CATALOG]
+    result = search_cache.get(params)
+    if result is None or result.generation != generation:
+        result = _load_search(params, generation)
+        search_cache.set(params, result)
+
+    cursor = request.args.get('cursor')
+    page_size = _page_size()
+    page = _search_page(result, cursor, page_size)
+    if page is None:
+        # курсор дальше сохранённого списка (или от старого поколения) — обычный запрос по ключу
+        query, order = _search_query(params, result.trigram)
+        page = _search_ids(query, order, cursor, page_size)
+    ids, next_cursor = page
+    products = _products_by_ids(ids)
+
+    facets = None
+    if result.counts is not None and not request.args.get('fragment'):
+        facets = _facet_links(result.counts)
+    url_args = {'substr': 1} if result.trigram else {}
+    return _render_product_page('search_results.html', products, next_cursor, url_args, q=q, facets=facets)
+
+
+# Параметры поиска в каноническом виде: «Платье », «платье» и «ПЛАТЬЕ»; new=1 и new=true;
+# min_price=100 и 100.0 дают один ключ. Параметры, которые поиск не читает (utm_* и т.п.), в ключ не входят,
+# номер страницы (cursor, per_page) — тоже: страницы нарезаются из одного списка
+SearchParams = namedtuple('SearchParams', 'q substr category min_price max_price brand color size tag new sale')
+
+# сохранённая выдача: поколение каталога, ключи сортировки строк (последним — id) не больше
+# SEARCH_CACHE_MAX_IDS, есть ли совпадения дальше, trigram-поиск или нет, фасеты
+SearchResult = namedtuple('SearchResult', 'generation keys complete trigram counts')
+
+
+def _price_arg(name):
+    try:
+        return float(request.args[name])
+    except (KeyError, ValueError, TypeError):
+        return None  # нет или некорректное значение — фильтр не ставим
+
+
+def _search_params():
+    args = request.args
+    return SearchParams(
+        q=" ".join(args.get('q', '').lower().split()),
+        substr=bool(args.get('substr')),
+        category=args.get('category') or None,
+        min_price=_price_arg('min_price'),
+        max_price=_price_arg('max_price'),
+        brand=lookup_key(args.get('brand')) or None,
+        color=lookup_key(args.get('color')) or None,
+        size=normalize_size(args.get('size')) or None,
+        tag=normalize_tag(args.get('tag')) or None,
+        new=bool(args.get('new')),
+        sale=bool(args.get('sale')),
+    )
 
-    # Новые параметры для атр поиска
-    brand = request.args.get('brand')
-    color = request.args.get('color')
-    size = request.args.get('size')
-    tag = request.args.get('tag')
 
-    
+def _search_query(params, trigram=False):
+    """
+    (запрос товаров со всеми фильтрами, сортировка [(колонка, desc)] с id последним).
+    Запрос None — искать нечего (в q нет ни одного слова)
+    """
     products_q = Product.query.filter(Product.in_stock == True)
 
-    # поиск по тексту
-    if q:
-        query_lower = q.lower()
-        products_q = products_q.filter(
-            Product.search_text.like(f"%{query_lower}%")
-        )
-
     # фильтр по категории
-    if category_slug:
-        category = Category.query.filter_by(slug=category_slug).first()
+    if params.category:
+        category = Category.query.filter_by(slug=params.category).first()
         if category:
             products_q = products_q.filter(Product.category_id == category.id)
 
     # Фильтр по цене
-    if min_price:
-        try:
-            min_val = float(min_price)
-            products_q = products_q.filter(Product.price >= min_val)
-        except (ValueError, TypeError):
-            pass  # игнорировать некорректные значения
-
-    if max_price:
-        try:
-            max_val = float(max_price)
-            products_q = products_q.filter(Product.price <= max_val)
-        except (ValueError, TypeError):
-            pass
-
-    # Фильтр по атрибутам
-    if brand:
-        products_q = products_q.filter(Product.brand.ilike(f"%{brand}%"))
-
-    if color:
-        products_q = products_q.filter(Product.color.ilike(f"%{color}%"))
-
-    if size:
-        # Поиск размера в строке sizes 
-        products_q = products_q.filter(Product.sizes.ilike(f"%{size}%"))
-
-    if tag:
-        # Поиск тега в строке tags .
-        products_q = products_q.filter(Product.tags.ilike(f"%{tag}%"))
+    if params.min_price is not None:
+        products_q = products_q.filter(Product.price >= params.min_price)
+    if params.max_price is not None:
+        products_q = products_q.filter(Product.price <= params.max_price)
+
+    # Фильтр по атрибутам — через справочники по индексу, точное совпадение
+    # (раньше ilike('%42%') находил и «142»). Не JOIN, а подзапросы: так SQLite идёт по товарам
+    # в порядке created_at (индекс) и останавливается на LIMIT, а не сортирует все совпадения
+    if params.brand:
+        brand_id = select(Brand.id).where(Brand.key == params.brand).scalar_subquery()
+        products_q = products_q.filter(Product.brand_id == brand_id)
+
+    if params.color:
+        color_id = select(Color.id).where(Color.key == params.color).scalar_subquery()
+        products_q = products_q.filter(Product.color_id == color_id)
+
+    if params.size:
+        products_q = products_q.filter(exists().where(ProductSize.product_id == Product.id,
+                                                      ProductSize.value == params.size))
+
+    if params.tag:
+        products_q = products_q.filter(exists().where(ProductTag.product_id == Product.id,
+                                                      ProductTag.value == params.tag))
 
     # Флаги: новинки и распродажа
-    if new:
+    if params.new:
         products_q = products_q.filter(Product.is_new == True)
-    if sale:
+    if params.sale:
         products_q = products_q.filter(Product.is_sale == True)
 
-    
-    products = products_q.order_by(Product.created_at.desc()).all()
-
-    return render_template('search_results.html', products=products, q=q)
-
-@app.route('/product/<int:product_id>')
+    if not params.q:
+        return products_q, PRODUCT_ORDER
+
+    # поиск по тексту: FTS5, сначала релевантные (bm25), при равенстве — новые
+    if search_index_ready(db.session.connection()):
+        fts = match_subquery(params.q, trigram=trigram)
+        if fts is None:
+            return None, PRODUCT_ORDER
+        products_q = products_q.join(fts, fts.c.id == Product.id)
+        return products_q, [(fts.c.rank, False), (Product.created_at, True), (Product.id, True)]
+
+    # FTS нет — старый вариант через LIKE
+    return products_q.filter(Product.search_text.like(f"%{params.q}%")), PRODUCT_ORDER
+
+
+def _search_ids(query, order, cursor, limit):
+    """Страница id (только колонки сортировки, без самих товаров) и курсор следующей"""
+    if query is None:
+        return [], None
+    rows, next_cursor = keyset_page(query.with_entities(*[column for column, _ in order]),
+                                    order, cursor, limit, list)
+    return [row[-1] for row in rows], next_cursor
+
+
+def _load_search(params, generation):
+    """Выдача по params: один запрос за id и ключами сортировки (не больше SEARCH_CACHE_MAX_IDS) и один — за фасеты"""
+    def load(trigram):
+        query, order = _search_query(params, trigram)
+        if query is None:
+            return None, [], None
+        rows, more = keyset_page(query.with_entities(*[column for column, _ in order]), order, None,
+                                 current_app.config['SEARCH_CACHE_MAX_IDS'], list)
+        return query, rows, more
+
+    trigram = params.substr
+    query, rows, more = load(trigram)
+    if not rows and params.q and not trigram and search_index_ready(db.session.connection()):
+        # по словам ничего — пробуем подстроку (trigram-индекс)
+        trigram = True
+        query, rows, more = load(trigram)
+
+    # фасеты («M (12), L (7)») — одним запросом по всем совпадениям
+    counts = facet_counts(query) if query is not None else None
+    return SearchResult(generation, tuple(tuple(row) for row in rows), more is None, trigram, counts)
+
+
+def _search_page(result, cursor, page_size):
+    """
+    (id, курсор следующей) — срез сохранённого списка; None, если нужная страница
+    за его пределами или курсор не из этого списка
+    """
+    start = 0
+    if cursor:
+        after = decode_cursor(cursor)
+        ids = [key[-1] for key in result.keys]
+        if not after or after[-1] not in ids:
+            return None
+        start = ids.index(after[-1]) + 1
+        if encode_cursor(result.keys[start - 1]) != cursor:
+            return None  # тот же товар, но ключ сортировки другой — курсор от старой выдачи
+    end = start + page_size
+    if end < len(result.keys):
+        return [key[-1] for key in result.keys[start:end]], encode_cursor(result.keys[end - 1])
+    if result.complete:
+        return [key[-1] for key in result.keys[start:]], None
+    return None
+
+
+def _products_by_ids(ids):
+    """Товары одним запросом по первичному ключу (IN), в порядке ids"""
+    if not ids:
+        return []
+    found = {product.id: product for product in Product.query.filter(Product.id.in_(ids))}
+    return [found[product_id] for product_id in ids if product_id in found]
+
+# параметр URL -> подпись в боковой панели
+FACETS = [('brand', 'Бренд'), ('color', 'Цвет'), ('size', 'Размер'), ('tag', 'Теги')]
+FACET_NORMALIZERS = {'brand': lookup_key, 'color': lookup_key, 'size': normalize_size, 'tag': normalize_tag}
+
+
+def _facet_links(counts):
+    """Фасеты со ссылками: клик ставит фильтр, повторный клик по выбранному — снимает"""
+    args = request.args.to_dict()
+    for name in ('cursor', 'fragment', 'substr'):
+        args.pop(name, None)
+
+    facets = []
+    for name, label in FACETS:
+        normalize = FACET_NORMALIZERS[name]
+        current = normalize(args.get(name))
+        items = []
+        for value, count in counts[name]:
+            active = bool(current) and normalize(value) == current
+            link_args = {k: v for k, v in args.items() if k != name}
+            if not active:
+                link_args[name] = value
+            items.append({'value': value, 'count': count, 'active': active,
+                          'url': url_for('shop.search', **link_args)})
+        if items:
+            facets.append({'name': name, 'label': label, 'items': items})
+    return facets
+
+def _cached_product(product_id):
+    def load():
+        found = db.session.get(Product, product_id)
+        return _cache_value(found, [found] if found else [])
+
+    return query_cache.get_or_load(_cache_key('product', product_id), load)
+
+
+@bp.route('/product/<int:product_id>')
+@conditional_page(_product_page_parts)
+@cached_page(_product_page_versions)
 def product(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = _cached_product(product_id)
+    if product is None:
+        abort(404)
     return render_template('product_detail.html', product=product)
 
-@app.route('/about')
+
+@bp.route('/api/product/<int:product_id>')
+def api_product(product_id):
+    """
+    Данные для всплывающего окна товара (openProductModal в base.html). Ответ кэшируется
+    вместе с ETag; браузер переспрашивает с If-None-Match и при неизменном товаре получает 304
+    """
+    product = _cached_product(product_id)
+    if product is None:
+        return jsonify(error="Товар не найден"), 404
+
+    key = ('api_product', product_id, product.updated_at, bool(image_manifest.get(_image_base(product.image) or '')))
+    cached = fragment_cache.get(key)
+    if cached is None:
+        body = json.dumps({
+            'id': product.id,
+            'title': product.title,
+            'description': product.description or '',
+            'price': product.price,
+            'old_price': product.old_price,
+            'discount': product.discount_percent,
+            'brand': product.brand or '',
+            'sizes': [size.strip() for size in (product.sizes or '').split(',') if size.strip()],
+            'is_new': bool(product.is_new),
+            'is_sale': bool(product.is_sale),
+            'image': url_for('static', filename='images/products/' + get_image_path(product.image, 'full')),
+            'url': url_for('shop.product', product_id=product.id),
+            'add_url': url_for('shop.add_to_cart', product_id=product.id),
+            'api_add_url': url_for('shop.api_cart_add', product_id=product.id),
+        }, ensure_ascii=False)
+        cached = (body, hashlib.md5(body.encode()).hexdigest())
+        fragment_cache.set(key, cached, weight=len(body) // 1024 + 1)
+
+    body, etag = cached
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True   # можно хранить, но перед показом — сверить ETag
+    return response.make_conditional(request)
+
+
+@bp.route('/img/<int:product_id>/<int:width>.<fmt>')
+def product_image(product_id, width, fmt):
+    """
+    Фото товара нужной ширины: режется из full-размера при первом запросе и ложится в дисковый кэш.
+    Ширины — только из IMAGE_WIDTHS, чтобы нельзя было забить кэш произвольными размерами
+    """
+    fmt = 'jpeg' if fmt == 'jpg' else fmt
+    if width not in current_app.config['IMAGE_WIDTHS'] or fmt not in available_formats(current_app.config['IMAGE_FORMATS']):
+        abort(404)
+    product = _cached_product(product_id)
+    if product is None:
+        abort(404)
+
+    base_name = _image_base(product.image)
+    source = (image_manifest.get(base_name) or {}).get(('full', 'jpeg')) if base_name else None
+    if source is None:
+        # placeholder или фото ещё в обработке
+        return redirect(url_for('static', filename='images/placeholder.png'))
+
+    ext = FORMATS[fmt][0]
+    path = image_cache.get_or_create(
+        f"{base_name}_{width}w.{ext}",
+        lambda dest: render_width(os.path.join(current_app.config['UPLOAD_FOLDER'], source['file']), dest, width, fmt),
+    )
+    # URL привязан к товару, а не к файлу: фото могут заменить, поэтому кэш браузера короткий —
+    # IMAGE_CACHE_MAX_AGE без запросов, дальше с проверкой (ETag / Last-Modified, ответ 304)
+    return send_file(path, mimetype=f"image/{fmt}", max_age=current_app.config['IMAGE_CACHE_MAX_AGE'], conditional=True)
+
+@bp.route('/about')
+@cached_page(_site_page_versions)
 def about():
     return render_template('about.html')
 
 #                         ===================== ЗАПУСК =====================
-if __name__ == "__main__":
+def init_db(app):
+    """
+    Схема базы и начальные данные: таблицы, миграции старых баз, индексы, админ, категории.
+    Запускается один раз перед стартом сервера (flask --app app init-db, python app.py,
+    serve.py), а не в каждом воркере и не в запросах
+    """
     with app.app_context():
         # Создаем все таблицы
         db.create_all()
@@ -680,6 +1588,28 @@ if __name__ == "__main__":
             print(f"Ошибка при добавлении столбца: {e}")
             db.session.rollback()
 
+        # время изменения товара (ETag страниц, кэш карточек); в старых базах — равно дате добавления
+        product_columns = [row[1] for row in db.session.execute(db.text("PRAGMA table_info(product)"))]
+        if 'updated_at' not in product_columns:
+            db.session.execute(db.text("ALTER TABLE product ADD COLUMN updated_at DATETIME"))
+            db.session.execute(db.text("UPDATE product SET updated_at = created_at"))
+            db.session.commit()
+            print("Добавлен столбец updated_at в таблицу product")
+
+        # одна строка корзины на товар + размер (в старых базах — склеить дубли)
+        if ensure_cart_constraints(db.session.connection()):
+            print("Склеены повторяющиеся позиции корзины")
+
+        # полнотекстовый индекс для поиска (создаётся один раз и заполняется из product)
+        ensure_search_index(db.session.connection())
+        # справочники размеров / тегов / брендов / цветов для фильтров
+        if ensure_attribute_index(db.session.connection()):
+            print("Заполнены справочники атрибутов товаров")
+        # индексы каталога (create_all не добавляет их в уже существующую таблицу product)
+        for name in ensure_catalog_indexes(db.session.connection()):
+            print("Создан индекс", name)
+        db.session.commit()
+
         # Проверка наличия placeholder
         placeholder_path = os.path.join(basedir, 'static', 'images', 'placeholder.jpg')
         if not os.path.exists(placeholder_path):
@@ -705,4 +1635,35 @@ if __name__ == "__main__":
             db.session.bulk_save_objects(cats)
             db.session.commit()
 
+
+def load_templates(app):
+    """
+    Загружает все шаблоны app в память процесса. Скомпилированные берутся из TEMPLATE_CACHE_FOLDER,
+    остальные компилируются и попадают туда же. Возвращает имена шаблонов
+    """
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+@bp.cli.command('compile-templates')
+def compile_templates_command():
+    """Заново скомпилировать все шаблоны в кэш байткода (при выкладке)"""
+    app = current_app._get_current_object()
+    if app.jinja_env.bytecode_cache is not None:
+        app.jinja_env.bytecode_cache.clear()  # байткод старых версий шаблонов больше не нужен
+    print(f"Скомпилировано шаблонов: {len(load_templates(app))}")
+
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Создать / обновить схему базы и начальные данные"""
+    init_db(current_app._get_current_object())
+
+
+if __name__ == "__main__":
+    # разработка: один процесс с отладчиком. Для продакшена — serve.py (несколько воркеров)
+    app = create_app()
+    init_db(app)
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -5,10 +5,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from utils.passwords import hash_password, verify_password
+from utils.db_profile import RoutingSession
 
 # создатьобъект БД. 
-db = SQLAlchemy()
+# RoutingSession: SELECT в GET-запросах может идти в пул только для чтения (SQLITE_READ_POOL)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Category(db.Model):
@@ -41,11 +43,15 @@ class Admin(UserMixin, db.Model):
 
     def set_password(self, password):
         """Хешируем пароль при создании/смене"""
-        self.password_hash = generate_password_hash(password, method='scrypt')
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
         """Проверяем пароль при входе"""
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def get_id(self):
+        # id админов и покупателей пересекаются — в сессии храним с типом
+        return f"admin:{self.id}"
 
     def __repr__(self):
         return f"<Admin {self.username} >"
@@ -73,11 +79,14 @@ class User(UserMixin, db.Model):
 
     def set_password(self, password):
         """Хешируем пароль при создании - смене"""
-        self.password_hash = generate_password_hash(password, method='scrypt')
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
         """Проверяем пароль при входе"""
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def get_id(self):
+        return f"user:{self.id}"
 
     def __repr__(self):
         return f"<User {self.username}>"
@@ -92,11 +101,16 @@ class CartItem(db.Model):
     Товар в корзине пользователя
     """
     __tablename__ = 'cart_item'
+    # одна строка на пользователя + товар + размер; повторное добавление — quantity + 1 (utils/cart.py)
+    __table_args__ = (
+        db.Index('uq_cart_item_line', 'user_id', 'product_id', 'size', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
-    size = db.Column(db.String(20), nullable=True)  # Размер товара
+    # Размер товара; '' — товар без размеров (не NULL: NULL не участвует в уникальности)
+    size = db.Column(db.String(20), nullable=False, default='', server_default='')
     quantity = db.Column(db.Integer, default=1, nullable=False)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -112,6 +126,22 @@ class Product(db.Model):
     Модель товара в магазине
     """
     __tablename__ = 'product'
+    # индексы под запросы каталога: все страницы сортируются по created_at DESC, id DESC
+    # (id — это rowid, SQLite сам дописывает его в конец любого индекса), фильтры — равенства.
+    # Частичные индексы (WHERE ...) — только нужные строки, и сортировка идёт прямо по ним.
+    # Планы проверяет scripts/check_query_plans.py
+    __table_args__ = (
+        db.Index('ix_product_created', 'created_at'),                          # новинки, поиск, админка
+        db.Index('ix_product_category_created', 'category_id', 'created_at'),  # каталог по категории
+        db.Index('ix_product_new_created', 'created_at', sqlite_where=db.text('is_new = 1')),
+        db.Index('ix_product_sale_created', 'created_at', sqlite_where=db.text('is_sale = 1')),
+        # фильтры по бренду / цвету (и внешние ключи справочников)
+        db.Index('ix_product_brand_created', 'brand_id', 'created_at'),
+        db.Index('ix_product_color_created', 'color_id', 'created_at'),
+        # покрывающий для фасетов поиска: все совпадения считаются по индексу, без чтения строк
+        db.Index('ix_product_facets', 'category_id', 'in_stock', 'is_new', 'is_sale', 'price',
+                 'brand_id', 'color_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)          # название товара
@@ -129,13 +159,19 @@ class Product(db.Model):
     color = db.Column(db.String(50), nullable=True)
     sku = db.Column(db.String(64), nullable=True)
     sizes = db.Column(db.String(200), nullable=True)            # размеры одежды через запятую (42, 44, 46, 48, 50 )
-    search_text = db.Column(db.Text, nullable=True, index=True)  # объединённый текст для поиска
+    search_text = db.Column(db.Text, nullable=True)  # объединённый текст для поиска (LIKE '%..%' индекс не использует)
+
+    # нормализованные копии атрибутов — для фильтров и фасетов (заполняются слушателями ниже)
+    brand_id = db.Column(db.Integer, db.ForeignKey('brand.id'), nullable=True)
+    color_id = db.Column(db.Integer, db.ForeignKey('color.id'), nullable=True)
 
     # внешний ключ — связь с категорией
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
 
     # Дата добавления  - для сортировки "новинки")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # последнее изменение (ставит before_product_save) — для ETag страницы товара и кэша карточек
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def update_search_text(self):
         parts = [
@@ -162,9 +198,164 @@ class Product(db.Model):
             return round((1 - self.price / self.old_price) * 100)
         return 0
     
-from sqlalchemy import event
+class Brand(db.Model):
+    """
+    Справочник брендов (заполняется сам при сохранении товара)
+    """
+    __tablename__ = 'brand'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)              # как ввели в первый раз
+    key = db.Column(db.String(80), unique=True, nullable=False)  # нижний регистр — для поиска
+
+    def __repr__(self):
+        return f"<Brand {self.name}>"
+
+
+class Color(db.Model):
+    """
+    Справочник цветов
+    """
+    __tablename__ = 'color'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(50), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"<Color {self.name}>"
+
+
+class ProductSize(db.Model):
+    """
+    Один размер товара — строка из Product.sizes ('42, 44' -> две строки)
+    """
+    __tablename__ = 'product_size'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    value = db.Column(db.String(20), primary_key=True)
+
+    # фильтр «размер = 42» идёт по этому индексу, а не по всей таблице
+    __table_args__ = (db.Index('ix_product_size_value', 'value', 'product_id'),)
+
+
+class ProductTag(db.Model):
+    """
+    Один тег товара
+    """
+    __tablename__ = 'product_tag'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    value = db.Column(db.String(50), primary_key=True)
+
+    __table_args__ = (db.Index('ix_product_tag_value', 'value', 'product_id'),)
+
+
+class CacheVersion(db.Model):
+    """
+    Версии данных для кэшей (categories, catalog) — см. utils/versions.py
+    """
+    __tablename__ = 'cache_version'
+
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from utils.search import index_product, unindex_product
+from utils.attributes import (split_values, normalize_size, normalize_tag,
+                              lookup_id, sync_product_values)
+from utils.cache import query_cache, page_cache, principal_cache
+from utils.versions import bump_version, CATEGORIES, CATALOG
+
+
+def _changed(target, *fields):
+    # при insert история тоже «изменена», так что новые товары попадают сюда всегда
+    state = inspect(target)
+    return any(state.attrs[f].history.has_changes() for f in fields)
+
 
 @event.listens_for(Product, 'before_insert')
 @event.listens_for(Product, 'before_update')
 def before_product_save(mapper, connection, target):
-    target.update_search_text()
\ No newline at end of file
+    target.updated_at = datetime.utcnow()
+    target.update_search_text()
+    if _changed(target, 'brand'):
+        target.brand_id = lookup_id(connection, 'brand', target.brand)
+    if _changed(target, 'color'):
+        target.color_id = lookup_id(connection, 'color', target.color)
+
+
+# FTS-индекс и размеры/теги обновляем после записи — до insert у товара ещё нет id
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def after_product_save(mapper, connection, target):
+    if _changed(target, 'search_text'):
+        index_product(connection, target.id, target.search_text)
+    if _changed(target, 'sizes'):
+        sync_product_values(connection, 'product_size', target.id, split_values(target.sizes, normalize_size))
+    if _changed(target, 'tags'):
+        sync_product_values(connection, 'product_tag', target.id, split_values(target.tags, normalize_tag))
+
+
+@event.listens_for(Product, 'after_delete')
+def after_product_delete(mapper, connection, target):
+    unindex_product(connection, target.id)
+    sync_product_values(connection, 'product_size', target.id, [])
+    sync_product_values(connection, 'product_tag', target.id, [])
+
+
+# кэш каталога: помечаем сессию при изменении товаров/категорий, а сбрасываем кэш
+# только после commit — иначе параллельный запрос успеет закэшировать старые данные
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def mark_catalog_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['catalog_changed'] = True
+        # какие страницы гостей устарели: списки товаров, страница самого товара, а при правке
+        # категории — все (меню категорий есть на каждой странице)
+        tags = session.info.setdefault('page_tags', {'catalog'})
+        tags.add('categories' if isinstance(target, Category) else f'product:{target.id}')
+    # общая версия в базе — по ней кэши остальных воркеров понимают, что данные устарели
+    bump_version(connection, CATALOG)
+    if isinstance(target, Category):
+        bump_version(connection, CATEGORIES)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_catalog_cache(session):
+    if session.info.pop('catalog_changed', False):
+        query_cache.clear()
+    tags = session.info.pop('page_tags', None)
+    if tags:
+        page_cache.purge(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_catalog_changes(session):
+    session.info.pop('catalog_changed', None)
+    session.info.pop('page_tags', None)
+    session.info.pop('principals_changed', None)
+
+
+# профиль или пароль поменялся — закэшированный вход этого воркера больше не годится
+@event.listens_for(Admin, 'after_update')
+@event.listens_for(Admin, 'after_delete')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def mark_principal_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('principals_changed', set()).add(target.get_id())
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_principals(session):
+    for principal_id in session.info.pop('principals_changed', ()):
+        principal_cache.pop(principal_id)
@@ -27,6 +27,10 @@ if 'search_text' not in cols:
     to_add.append("ALTER TABLE product ADD COLUMN search_text TEXT")
 if 'sizes' not in cols:
     to_add.append("ALTER TABLE product ADD COLUMN sizes VARCHAR(200)")
+if 'brand_id' not in cols:
+    to_add.append("ALTER TABLE product ADD COLUMN brand_id INTEGER REFERENCES brand(id)")
+if 'color_id' not in cols:
+    to_add.append("ALTER TABLE product ADD COLUMN color_id INTEGER REFERENCES color(id)")
 
 if not to_add:
     print('All columns already exist.')
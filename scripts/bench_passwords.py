@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, basedir)
+from utils import passwords
+
+# Замер входов под нагрузкой: LOGINS проверок пароля из THREADS потоков (как веб-воркер с потоками),
+# и параллельно — «страницы каталога» (немного чистого Python), у которых меряем задержку.
+# Сравниваем scrypt в потоке запроса и в пуле процессов.
+#   python scripts/bench_passwords.py [threads] [logins]
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+LOGINS = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+
+def fake_page():
+    # примерно как рендер карточек: словари, строки, json
+    items = [{"id": i, "title": f"Товар {i}", "price": i * 10} for i in range(300)]
+    return len(json.dumps(items, ensure_ascii=False))
+
+
+def run(use_pool):
+    passwords.configure(use_pool=use_pool, workers=2, queue_size=LOGINS)
+    pwhash = passwords.hash_password("secret1")  # заодно прогреваем пул
+    page_times = []
+    stop = threading.Event()
+
+    def pages():
+        while not stop.is_set():
+            start = time.perf_counter()
+            fake_page()
+            page_times.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    page_thread = threading.Thread(target=pages)
+    page_thread.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(lambda _: passwords.verify_password(pwhash, "secret1"), range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    page_thread.join()
+
+    assert all(results)
+    page_times.sort()
+    p50 = page_times[len(page_times) // 2] * 1000
+    p99 = page_times[int(len(page_times) * 0.99)] * 1000
+    mode = 'pool  ' if use_pool else 'inline'
+    print(f'{mode}: {LOGINS / elapsed:6.1f} logins/s, page p50 {p50:5.1f} ms, p99 {p99:6.1f} ms '
+          f'({len(page_times)} pages)')
+
+
+if __name__ == '__main__':
+    print(f'{THREADS} threads, {LOGINS} logins, {os.cpu_count()} CPUs')
+    run(use_pool=False)
+    run(use_pool=True)
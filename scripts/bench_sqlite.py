@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, basedir)
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from utils.db_profile import DEFAULT_PRAGMAS, apply_pragmas
+
+# Замер профиля SQLite: THREADS потоков читают «страницы каталога», один поток пишет
+# (как корзина/админка). Сравниваем настройки по умолчанию (rollback-журнал, без busy_timeout)
+# с DEFAULT_PRAGMAS (WAL, synchronous=NORMAL, busy_timeout...) на временной базе.
+#   python scripts/bench_sqlite.py [threads] [seconds]
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+PRODUCTS = 5000
+
+PAGE_SQL = text("SELECT id, title, price FROM product WHERE category_id = :category AND is_active = 1 "
+                "ORDER BY created_at DESC, id DESC LIMIT 24")
+
+
+def make_database(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE product (id INTEGER PRIMARY KEY, title TEXT, price REAL, "
+                             "category_id INTEGER, is_active INTEGER, created_at TEXT)")
+        conn.exec_driver_sql("CREATE TABLE cart_item (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                             "product_id INTEGER, quantity INTEGER)")
+        conn.execute(text("INSERT INTO product (title, price, category_id, is_active, created_at) "
+                          "VALUES (:title, :price, :category, 1, :created)"),
+                     [dict(title=f"Товар {i}", price=100 + i, category=i % 10, created=f"2024-01-{i % 28 + 1:02d}")
+                      for i in range(PRODUCTS)])
+    engine.dispose()
+
+
+def run(name, pragmas):
+    with tempfile.TemporaryDirectory() as tmp:
+        measure(name, pragmas, os.path.join(tmp, 'bench.db'))
+
+
+def measure(name, pragmas, path):
+    make_database(path)
+    engine = create_engine(f"sqlite:///{path}", pool_size=THREADS + 1, max_overflow=0,
+                           connect_args={'timeout': 0})
+    if pragmas:
+        apply_pragmas(engine, pragmas)
+
+    latencies = []
+    errors = {'read': 0, 'write': 0}
+    writes = 0
+    deadline = time.perf_counter() + SECONDS
+
+    def reader(_):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(PAGE_SQL, {'category': random.randrange(10)}).all()
+            except OperationalError:
+                errors['read'] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    def writer():
+        nonlocal writes
+        while time.perf_counter() < deadline:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("INSERT INTO cart_item (user_id, product_id, quantity) VALUES (:u, :p, 1)"),
+                                 {'u': random.randrange(100), 'p': random.randrange(PRODUCTS)})
+                writes += 1
+            except OperationalError:
+                errors['write'] += 1
+
+    write_thread = threading.Thread(target=writer)
+    write_thread.start()
+    with ThreadPoolExecutor(THREADS) as executor:
+        list(executor.map(reader, range(THREADS)))
+    write_thread.join()
+    engine.dispose()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    print(f'{name}: {len(latencies) / SECONDS:7.0f} reads/s, p50 {p50:5.2f} ms, p99 {p99:6.2f} ms, '
+          f'{writes / SECONDS:5.0f} writes/s, locked: {errors["read"]} reads / {errors["write"]} writes')
+
+
+if __name__ == '__main__':
+    print(f'{THREADS} reader threads + 1 writer, {SECONDS:g} s, {os.cpu_count()} CPUs')
+    run('default', {})
+    run('tuned  ', DEFAULT_PRAGMAS)
@@ -0,0 +1,27 @@
+import sqlite3
+import os
+import sys
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, basedir)
+from utils.search import CREATE_FTS_SQL, CREATE_TRIGRAM_SQL, REBUILD_SQL
+
+db_path = os.path.join(basedir, 'instance', 'shop.db')
+
+if not os.path.exists(db_path):
+    print('Database not found:', db_path)
+    raise SystemExit(1)
+
+con = sqlite3.connect(db_path)
+cur = con.cursor()
+
+# Пересоздаём FTS-индекс поиска с нуля (после populate_search_text.py или ручных правок БД)
+cur.execute(CREATE_FTS_SQL)
+cur.execute(CREATE_TRIGRAM_SQL)
+for stmt in REBUILD_SQL:
+    cur.execute(stmt)
+
+con.commit()
+cur.execute("SELECT count(*) FROM product_fts")
+print(f'Indexed {cur.fetchone()[0]} products.')
+con.close()
@@ -0,0 +1,54 @@
+import os
+import sys
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, basedir)
+
+# Проверка постраничного вывода на подделанных курсорах: ?cursor= приходит из URL, и любой мусор
+# в нём должен давать первую страницу, а не 500. Открывает catalog / novelties / search
+# с курсорами не того типа и вне диапазона; код выхода 1, если хоть один ответ >= 500.
+#   python scripts/check_cursors.py
+# Нужна база instance/shop.db (python app.py создаёт её).
+
+db_path = os.path.join(basedir, 'instance', 'shop.db')
+
+if not os.path.exists(db_path):
+    print('Database not found:', db_path)
+    raise SystemExit(1)
+
+from app import create_app
+from utils.pagination import encode_cursor
+
+DATE = '2026-01-01T00:00:00'
+CURSORS = [
+    [DATE, 10 ** 30],              # id больше 64 бит — OverflowError в драйвере
+    [DATE, -10 ** 30],
+    [1.5, DATE, 10 ** 30],         # выдача по релевантности: rank, дата, id
+    ['2026-01-01', {'a': 1}],      # не тот тип
+    [[1], [2]],
+    [True, 1],
+    ['не дата', 1],
+    [None, 2],
+]
+PAGES = ['/catalog', '/catalog?category=women&new=true', '/novelties',
+         '/search?min_price=1', '/search?q=платье']
+
+
+def main():
+    # PROPAGATE_EXCEPTIONS=False: ошибка в обработчике — ответ 500, а не исключение в скрипте
+    client = create_app({'TESTING': True, 'PROPAGATE_EXCEPTIONS': False, 'PAGE_CACHE': False}).test_client()
+    failed = 0
+    for values in CURSORS:
+        cursor = encode_cursor(values)
+        for page in PAGES:
+            url = f"{page}{'&' if '?' in page else '?'}cursor={cursor}"
+            status = client.get(url).status_code
+            if status >= 500:
+                failed += 1
+                print(f'{url}  {values!r}: HTTP {status}')
+    print(f'{len(CURSORS) * len(PAGES)} requests, {failed} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+import os
+import sys
+from datetime import datetime
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, basedir)
+
+# Проверка планов запросов каталога: открывает страницы catalog / novelties / search / admin_products
+# (со всеми сочетаниями фильтров и со второй страницей), собирает каждый SELECT и прогоняет его
+# через EXPLAIN QUERY PLAN. Код выхода 1, если где-то полный просмотр большой таблицы или
+# сортировка во временном B-дереве — значит, запрос перестал попадать в индекс.
+#   python scripts/check_query_plans.py       — только проблемы
+#   python scripts/check_query_plans.py -v    — все планы
+# Нужна база instance/shop.db (python app.py создаёт её вместе с индексами).
+# Без ANALYZE план не зависит от числа строк, поэтому хватает и почти пустой базы.
+
+db_path = os.path.join(basedir, 'instance', 'shop.db')
+verbose = '-v' in sys.argv
+
+if not os.path.exists(db_path):
+    print('Database not found:', db_path)
+    raise SystemExit(1)
+
+from sqlalchemy import event
+from app import create_app
+from models import db, Admin, Category, Brand, Color, ProductSize, ProductTag, Product
+from utils.indexes import explain, plan_problems
+from utils.pagination import encode_cursor
+
+# выдача по релевантности (bm25) сортируется по rank — его нет ни в одном индексе
+RANKED_MARKER = 'product_fts'
+
+
+def first(query, default):
+    value = query.first()
+    return value[0] if value else default
+
+
+def route_urls():
+    cursor = encode_cursor([datetime.utcnow(), 2 ** 31])  # «вторая страница»
+    category = first(db.session.query(Category.slug), 'women')
+    brand = first(db.session.query(Brand.name), 'brand')
+    color = first(db.session.query(Color.name), 'color')
+    size = first(db.session.query(ProductSize.value), 'M')
+    tag = first(db.session.query(ProductTag.value), 'tag')
+    product_id = first(db.session.query(Product.id), 1)
+
+    urls = ['/novelties', f'/novelties?cursor={cursor}', f'/product/{product_id}']
+    for args in ('', f'category={category}', 'new=true', 'sale=true', f'category={category}&new=true',
+                 f'category={category}&sale=true', 'new=true&sale=true'):
+        urls += [f'/catalog?{args}', f'/catalog?{args}&cursor={cursor}']
+    for args in ('', 'q=платье', 'q=плат&substr=1', 'min_price=100', 'min_price=100&max_price=500',
+                 f'category={category}', f'category={category}&min_price=100&max_price=500', 'new=1', 'sale=1',
+                 f'brand={brand}', f'color={color}', f'size={size}', f'tag={tag}', f'q=платье&category={category}'):
+        urls += [f'/search?{args}', f'/search?{args}&cursor={cursor}']
+    return urls
+
+
+def main():
+    statements = {}
+    current_url = None
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        if current_url and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.setdefault(statement, (current_url, parameters))
+
+    app = create_app({'TESTING': True})
+    with app.app_context():
+        for engine in filter(None, [db.engine, app.extensions.get('sqlite_read_engine')]):
+            event.listen(engine, 'before_cursor_execute', collect)
+        urls = route_urls()
+        admin_id = first(db.session.query(Admin.id), None)
+
+    client = app.test_client()
+    for current_url in urls:
+        response = client.get(current_url)
+        if response.status_code >= 500:
+            print(f'{current_url}: HTTP {response.status_code}')
+    if admin_id is not None:
+        with client.session_transaction() as session:
+            session['_user_id'] = f'admin:{admin_id}'
+            session['_fresh'] = True
+        current_url = '/admin/products'
+        client.get(current_url)
+
+    failed = 0
+    tables = set(db.metadata.tables)
+    with app.app_context(), db.engine.connect() as conn:
+        for statement, (url, parameters) in statements.items():
+            plan = explain(conn, statement, parameters)
+            problems = plan_problems(plan, tables)
+            if RANKED_MARKER in statement:
+                problems = [p for p in problems if not p.startswith('USE TEMP B-TREE')]
+            if problems:
+                failed += 1
+            if problems or verbose:
+                print(f'--- {url}\n{" ".join(statement.split())[:300]}')
+                for detail in plan:
+                    print(('  !! ' if detail in problems else '     ') + detail)
+
+    print(f'{len(statements)} queries from {len(urls) + 1} pages, {failed} with problems')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
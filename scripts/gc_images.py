@@ -0,0 +1,93 @@
+import sqlite3
+import os
+import re
+import sys
+import time
+
+# Удаляет файлы фото, на которые не ссылается ни один товар:
+# размеры в static/images/products, записи манифеста и нарезки /img/ из кэша.
+# Папки читаются одним проходом os.scandir, без загрузки списка файлов целиком.
+#   python scripts/gc_images.py            — удалить
+#   python scripts/gc_images.py --dry-run  — только показать, что будет удалено
+# Файлы моложе GRACE_SECONDS не трогаем: фото могло только что загрузиться, а товар ещё не сохранён.
+# Фото, застрявшие в staging дольше GRACE_SECONDS, сначала нарезаются.
+
+GRACE_SECONDS = 3600
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+db_path = os.path.join(basedir, 'instance', 'shop.db')
+upload_folder = os.path.join(basedir, 'static', 'images', 'products')
+staging_folder = os.path.join(basedir, 'instance', 'image_staging')
+manifest_folder = os.path.join(basedir, 'instance', 'image_manifest')
+cache_folder = os.path.join(basedir, 'instance', 'image_cache')
+
+# <base>_thumb.jpg, <base>_full.webp, <base>.json, <base>_640w.webp, недописанные .tmp
+BASE_RE = re.compile(r"^([0-9a-f]{32})[_.]")
+
+dry_run = '--dry-run' in sys.argv
+
+if not os.path.exists(db_path):
+    print('Database not found:', db_path)
+    raise SystemExit(1)
+
+con = sqlite3.connect(db_path)
+cur = con.cursor()
+cur.execute("SELECT DISTINCT image FROM product WHERE image IS NOT NULL")
+# ссылка — любое имя, не только '<base>_thumb.jpg': старые товары указывают прямо на файл
+# ('<base>.png'), его сайт отдаёт как есть — база этого имени тоже живая
+referenced = set()
+for (image,) in cur:
+    match = BASE_RE.match(os.path.basename(image))
+    if match:
+        referenced.add(match.group(1))
+con.close()
+
+# .upload старше GRACE_SECONDS — обработка оборвалась (очередь пула живёт только в памяти веб-процесса).
+# Доделываем здесь, иначе фото навсегда «в обработке», а файл в staging вечно считался бы живым
+if os.path.isdir(staging_folder):
+    if dry_run:
+        with os.scandir(staging_folder) as entries:
+            for e in entries:
+                if e.name.endswith('.upload') and e.stat().st_mtime < time.time() - GRACE_SECONDS:
+                    print('would process', e.path)
+    else:
+        sys.path.insert(0, basedir)
+        from app import create_app
+        from utils.image_processor import process_abandoned_uploads
+        with create_app().app_context():
+            finished = process_abandoned_uploads(GRACE_SECONDS)
+        if finished:
+            print(f'Processed {finished} abandoned uploads')
+
+# фото в очереди на обработку тоже считаются живыми
+if os.path.isdir(staging_folder):
+    with os.scandir(staging_folder) as entries:
+        referenced.update(BASE_RE.match(e.name).group(1) for e in entries if BASE_RE.match(e.name))
+
+cutoff = time.time() - GRACE_SECONDS
+removed = 0
+freed = 0
+for folder in (upload_folder, manifest_folder, cache_folder):
+    if not os.path.isdir(folder):
+        continue
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            match = BASE_RE.match(entry.name)
+            if not match or match.group(1) in referenced or not entry.is_file():
+                continue
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            if dry_run:
+                print('would remove', entry.path)
+            else:
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    print('cannot remove', entry.path, e)
+                    continue
+            removed += 1
+            freed += stat.st_size
+
+action = 'Would remove' if dry_run else 'Removed'
+print(f'{action} {removed} files, {freed / 1024 / 1024:.1f} MB; {len(referenced)} images in use.')
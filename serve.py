@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+import multiprocessing
+
+# Продакшен-запуск: главный процесс открывает порт и держит WORKERS воркеров (fork),
+# каждый — многопоточный WSGI-сервер werkzeug на общем сокете.
+#   python serve.py --bind 0.0.0.0:8000 --workers 4
+# Перед стартом один раз выполняются flask init-db (схема и начальные данные) и
+# flask compile-templates (байткод шаблонов) — не в воркерах. Проверка изменений шаблонов
+# в воркерах выключена: новые шаблоны — через HUP.
+# Сигналы главному процессу:
+#   HUP        — плавный перезапуск: новые воркеры (с новым кодом), старые дослуживают запросы
+#   TERM / INT — плавная остановка
+# Воркер сам уходит после --max-requests запросов (+ случайный разброс), главный процесс
+# запускает вместо него новый: так не копятся утечки памяти.
+# Главный процесс приложение не импортирует — код загружает каждый воркер после fork.
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, basedir)
+
+CRASH_SECONDS = 5   # воркер упал быстрее — приложение не запускается, перезапускать бессмысленно
+
+
+def log(message):
+    print(f"[{os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Магазин: запуск с несколькими воркерами")
+    parser.add_argument("--bind", default="127.0.0.1:8000", help="host:port")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--max-requests", type=int, default=1000, help="0 — не перезапускать воркеры")
+    parser.add_argument("--max-requests-jitter", type=int, default=100)
+    parser.add_argument("--graceful-timeout", type=float, default=30,
+                        help="сколько секунд ждать текущие запросы при остановке воркера")
+    parser.add_argument("--no-init-db", action="store_true", help="не запускать flask init-db")
+    parser.add_argument("--no-compile-templates", action="store_true",
+                        help="не запускать flask compile-templates")
+    return parser.parse_args()
+
+
+def open_socket(bind):
+    host, _, port = bind.rpartition(":")
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host.strip("[]") or "0.0.0.0", int(port)))
+    sock.listen(128)
+    # accept без блокировки: соединение, которое забрал соседний воркер, не подвешивает этот
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(sock, args):
+    """Процесс-воркер: импортирует приложение и обслуживает запросы до TERM или лимита запросов"""
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl+C ловит главный процесс
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    from wsgi import app
+
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.socket.setblocking(False)
+    server.daemon_threads = False   # server_close() дождётся запросов, которые уже выполняются
+    stopping = threading.Event()
+
+    def stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            # shutdown() ждёт выхода из serve_forever — поэтому из отдельного потока
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    limit = args.max_requests + random.randint(0, args.max_requests_jitter) if args.max_requests else 0
+    served = 0
+    lock = threading.Lock()
+
+    def counting_app(environ, start_response):
+        nonlocal served
+        with lock:
+            served += 1
+            if limit and served >= limit:
+                stop()
+        return app(environ, start_response)
+
+    server.app = counting_app
+    signal.signal(signal.SIGTERM, stop)
+    log(f"воркер слушает {host}:{port}")
+    server.serve_forever()
+    server.server_close()
+    log(f"воркер остановлен ({served} запросов)")
+
+
+class Master:
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.context = multiprocessing.get_context("fork")
+        self.workers = {}      # Process -> время запуска
+        self.retiring = {}     # Process -> когда отправлен TERM
+        self.reload = False
+        self.stopping = False
+        self.failed = False
+
+    def spawn(self):
+        worker = self.context.Process(target=run_worker, args=(self.sock, self.args), daemon=False)
+        worker.start()
+        self.workers[worker] = time.monotonic()
+
+    def retire(self, worker):
+        self.workers.pop(worker, None)
+        if worker not in self.retiring and worker.is_alive():
+            os.kill(worker.pid, signal.SIGTERM)
+            self.retiring[worker] = time.monotonic()
+
+    def reap(self):
+        """Убирает завершившиеся процессы; вместо ушедших воркеров запускает новые"""
+        now = time.monotonic()
+        for worker, started in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+            worker.join()
+            del self.workers[worker]
+            if worker.exitcode != 0 and now - started < CRASH_SECONDS:
+                log(f"воркер {worker.pid} упал при запуске (код {worker.exitcode}) — остановка")
+                self.stopping = self.failed = True
+            elif not self.stopping:
+                self.spawn()
+        for worker, since in list(self.retiring.items()):
+            if not worker.is_alive():
+                worker.join()
+                del self.retiring[worker]
+            elif now - since > self.args.graceful_timeout:
+                log(f"воркер {worker.pid} не остановился за {self.args.graceful_timeout:g} с — kill")
+                worker.kill()
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "reload", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+
+        for _ in range(self.args.workers):
+            self.spawn()
+        log(f"запущено воркеров: {self.args.workers}")
+
+        while not (self.stopping and not self.workers and not self.retiring):
+            if self.reload:
+                self.reload = False
+                log("перезапуск воркеров")
+                old = list(self.workers)
+                for _ in range(self.args.workers):
+                    self.spawn()
+                for worker in old:
+                    self.retire(worker)
+            if self.stopping:
+                for worker in list(self.workers):
+                    self.retire(worker)
+            self.reap()
+            time.sleep(0.2)
+        log("остановлен")
+        return 1 if self.failed else 0
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("SHOP_TEMPLATES_AUTO_RELOAD", "false")
+    # схема, начальные данные и шаблоны — один раз, отдельными процессами, до открытия порта
+    for command, skip in (("init-db", args.no_init_db), ("compile-templates", args.no_compile_templates)):
+        if not skip:
+            subprocess.run([sys.executable, "-m", "flask", "--app", "app:create_app", command], cwd=basedir, check=True)
+    sock = open_socket(args.bind)
+    log(f"слушаем {args.bind}")
+    return Master(sock, args).run()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
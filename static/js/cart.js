@@ -1,46 +1,72 @@
-document.addEventListener('DOMContentLoaded', () => {
-    document.querySelectorAll('.quantity-form').forEach(form => {
-        const buttons = form.querySelectorAll('.quantity-btn');
-        const input = form.querySelector('.quantity-input');
-
-        buttons.forEach(btn => {
-            btn.addEventListener('click', (e) => {
-                e.preventDefault();
+// корзина: +/- и удаление без перезагрузки — через /api/cart/items/<id>.
+// Частые клики копятся и уходят одним запросом; если API недоступно — обычная отправка формы
+const CART_DEBOUNCE_MS = 350;
 
-                if (form.dataset.submitting === 'true') return;
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('.cart-line').forEach(initCartLine);
+});
 
-                let value = parseInt(input.value, 10);
-                if (isNaN(value)) value = 1;
+function initCartLine(line) {
+    const form = line.querySelector('.quantity-form');
+    const input = form.querySelector('.quantity-input');
+    const removeForm = line.querySelector('.remove-form');
+    const csrf = form.querySelector('input[name="csrf_token"]').value;
+    let timer = null;
+    let sent = 0;  // номер последнего запроса: ответы на устаревшие не трогают поле количества
 
-                if (btn.classList.contains('minus')) {
-                    if (value <= 1) {
-                        // Удаляем товар: устанавливаем 0 и отправляем
-                        input.value = 0;
-                    } else {
-                        input.value = value - 1;
-                    }
-                } else {
-                    input.value = value + 1;
-                }
+    const send = (method, body) => {
+        const seq = ++sent;
+        return fetch(line.dataset.apiUrl, {
+            method,
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrf },
+            body: body ? JSON.stringify(body) : undefined,
+        })
+            .then(r => r.ok ? r.json() : Promise.reject(r.status))
+            .then(data => applyCart(line, data, seq === sent && timer === null));
+    };
 
-                // Блокировка и отправка
-                form.dataset.submitting = 'true';
-                buttons.forEach(b => b.disabled = true);
-                btn.textContent = '...';
+    const schedule = () => {
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+            timer = null;
+            const quantity = Math.max(0, parseInt(input.value, 10) || 0);
+            send('POST', { quantity }).catch(() => form.submit());
+        }, CART_DEBOUNCE_MS);
+    };
 
-                form.submit();
-            });
+    form.querySelectorAll('.quantity-btn').forEach(btn => {
+        btn.addEventListener('click', (e) => {
+            e.preventDefault();
+            let value = parseInt(input.value, 10);
+            if (isNaN(value)) value = 1;
+            // на «-» при одной штуке — 0, сервер удалит позицию
+            input.value = btn.classList.contains('minus') ? Math.max(0, value - 1) : value + 1;
+            schedule();
         });
     });
-});
+    input.addEventListener('change', schedule);
+    form.addEventListener('submit', (e) => {
+        e.preventDefault();
+        schedule();
+    });
 
-window.addEventListener('pageshow', () => {
-    document.querySelectorAll('.quantity-form').forEach(form => {
-        delete form.dataset.submitting;
-        form.querySelectorAll('.quantity-btn').forEach(b => {
-            b.disabled = false;
-            if (b.classList.contains('plus')) b.textContent = '+';
-            if (b.classList.contains('minus')) b.textContent = '-';
-        });
+    removeForm?.addEventListener('submit', (e) => {
+        e.preventDefault();
+        clearTimeout(timer);
+        timer = null;
+        send('DELETE').catch(() => removeForm.submit());
     });
-});
\ No newline at end of file
+}
+
+function applyCart(line, data, updateInput) {
+    if (data.line) {
+        if (updateInput) line.querySelector('.quantity-input').value = data.line.quantity;
+        line.querySelector('.cart-line-total').textContent = Math.trunc(data.line.line_total);
+    } else {
+        line.remove();
+    }
+    document.querySelectorAll('.cart-total').forEach(el => el.textContent = Math.trunc(data.total));
+    document.querySelectorAll('.cart-badge').forEach(el => el.textContent = data.count);
+    // корзина опустела — заглушку «корзина пуста» рисует сервер
+    if (data.count === 0) window.location.reload();
+}
@@ -49,4 +49,112 @@ document.addEventListener("DOMContentLoaded", () => {
             }
         });
     }
-});
\ No newline at end of file
+
+    // === БЕСКОНЕЧНАЯ ПРОКРУТКА каталога / поиска ===
+    initLoadMore();
+
+    // === «В корзину» без перезагрузки страницы ===
+    initAddToCart();
+});
+
+function initAddToCart() {
+    // формы с data-api-action отправляются в /api/cart/add/<id>; при ошибке сети — как обычная форма
+    document.addEventListener("submit", (e) => {
+        const form = e.target;
+        if (!form.dataset || !form.dataset.apiAction) return;
+        e.preventDefault();
+
+        fetch(form.dataset.apiAction, { method: "POST", body: new FormData(form) })
+            .then(r => {
+                if (r.status === 401 || r.status >= 500) throw new Error(r.status);
+                return r.json().then(data => ({ ok: r.ok, data }));
+            })
+            .then(({ ok, data }) => {
+                if (!ok) {
+                    showFlash(data.error, "error");
+                    return;
+                }
+                showFlash(data.message, data.category);
+                document.querySelectorAll(".cart-badge").forEach(el => el.textContent = data.count);
+            })
+            .catch(() => form.submit());
+    });
+}
+
+function showFlash(message, category) {
+    const container = document.querySelector(".flashes-container");
+    if (!container || !message) return;
+    let list = container.querySelector(".flashes");
+    if (!list) {
+        list = document.createElement("div");
+        list.className = "flashes";
+        container.appendChild(list);
+    }
+    const flash = document.createElement("div");
+    flash.className = `flash flash--${category}`;
+    flash.textContent = message;
+    list.prepend(flash);
+    flash.scrollIntoView({ block: "nearest", behavior: "smooth" });
+    setTimeout(() => flash.remove(), 5000);
+}
+
+function initLoadMore() {
+    const grid = document.querySelector(".products-grid");
+    let link = document.querySelector(".load-more");
+    if (!grid || !link) return;
+
+    let loading = false;
+
+    const loadNext = () => {
+        if (loading || !link) return;
+        loading = true;
+        link.textContent = "Загрузка...";
+
+        fetch(link.dataset.fragmentUrl, { headers: { "X-Requested-With": "fetch" } })
+            .then(r => {
+                if (!r.ok) throw new Error(r.status);
+                return r.text();
+            })
+            .then(html => {
+                const tpl = document.createElement("template");
+                tpl.innerHTML = html;
+
+                // карточки — в сетку, старую ссылку заменяем новой (или убираем на последней странице)
+                tpl.content.querySelectorAll(".product-card").forEach(card => grid.appendChild(card));
+                const wrapper = link.closest(".load-more-wrapper");
+                const nextWrapper = tpl.content.querySelector(".load-more-wrapper");
+                if (nextWrapper) {
+                    wrapper.replaceWith(nextWrapper);
+                    link = nextWrapper.querySelector(".load-more");
+                    observer?.observe(link);
+                } else {
+                    wrapper.remove();
+                    link = null;
+                }
+            })
+            .catch(() => {
+                // не получилось — пусть работает как обычная ссылка
+                if (link) link.textContent = "Показать ещё";
+            })
+            .finally(() => { loading = false; });
+    };
+
+    document.addEventListener("click", (e) => {
+        if (e.target.classList.contains("load-more")) {
+            e.preventDefault();
+            loadNext();
+        }
+    });
+
+    const observer = "IntersectionObserver" in window
+        ? new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    loadNext();
+                }
+            });
+        }, { rootMargin: "600px" })
+        : null;
+    observer?.observe(link);
+}
\ No newline at end of file
@@ -0,0 +1,127 @@
+# нормализованные атрибуты товара: размеры, теги, бренд, цвет (для фильтров и фасетов)
+
+from sqlalchemy import select, func, literal, union_all
+
+
+def split_values(raw, normalize):
+    """'42, 44,44 ,46' -> ['42', '44', '46'] (без пустых и повторов, порядок сохраняем)"""
+    result = []
+    for part in (raw or "").split(","):
+        value = normalize(part)
+        if value and value not in result:
+            result.append(value)
+    return result
+
+
+def normalize_size(value):
+    # размеры: 'm' == 'M', '42 ' == '42'
+    return (value or "").strip().upper()
+
+
+def normalize_tag(value):
+    return (value or "").strip().lower()
+
+
+def lookup_key(value):
+    """Ключ для справочников brand / color: без регистра и лишних пробелов"""
+    return " ".join((value or "").split()).lower().replace("ё", "е")
+
+
+def lookup_id(connection, table, name):
+    """
+    id записи справочника (brand / color) по названию, при необходимости создаёт её.
+    None для пустого названия
+    """
+    key = lookup_key(name)
+    if not key:
+        return None
+    connection.exec_driver_sql(
+        f"INSERT OR IGNORE INTO {table} (name, key) VALUES (?, ?)", (name.strip(), key)
+    )
+    return connection.exec_driver_sql(f"SELECT id FROM {table} WHERE key = ?", (key,)).scalar()
+
+
+def sync_product_values(connection, table, product_id, values):
+    """Перезаписывает строки товара в product_size / product_tag"""
+    connection.exec_driver_sql(f"DELETE FROM {table} WHERE product_id = ?", (product_id,))
+    if values:
+        connection.exec_driver_sql(
+            f"INSERT INTO {table} (product_id, value) VALUES (?, ?)",
+            [(product_id, value) for value in values],
+        )
+
+
+def rebuild_attributes(connection):
+    """
+    Заполняет справочники по всем товарам (для базы, созданной до их появления).
+    Возвращает число обработанных товаров
+    """
+    rows = connection.exec_driver_sql("SELECT id, sizes, tags, brand, color FROM product").fetchall()
+    for product_id, sizes, tags, brand, color in rows:
+        sync_product_values(connection, "product_size", product_id, split_values(sizes, normalize_size))
+        sync_product_values(connection, "product_tag", product_id, split_values(tags, normalize_tag))
+        connection.exec_driver_sql(
+            "UPDATE product SET brand_id = ?, color_id = ? WHERE id = ?",
+            (lookup_id(connection, "brand", brand), lookup_id(connection, "color", color), product_id),
+        )
+    return len(rows)
+
+
+def ensure_attribute_index(connection):
+    """
+    Старые базы: добавляет product.brand_id / color_id и один раз заполняет справочники.
+    Таблицы product_size, product_tag, brand, color создаёт db.create_all()
+    """
+    cols = [row[1] for row in connection.exec_driver_sql("PRAGMA table_info(product)").fetchall()]
+    added = False
+    for col, ref in (("brand_id", "brand"), ("color_id", "color")):
+        if col not in cols:
+            # индекс (brand_id, created_at) создаст ensure_catalog_indexes
+            connection.exec_driver_sql(f"ALTER TABLE product ADD COLUMN {col} INTEGER REFERENCES {ref}(id)")
+            added = True
+
+    indexed = connection.exec_driver_sql(
+        "SELECT EXISTS(SELECT 1 FROM product_size) OR EXISTS(SELECT 1 FROM product_tag) "
+        "OR EXISTS(SELECT 1 FROM product WHERE brand_id IS NOT NULL OR color_id IS NOT NULL)"
+    ).scalar()
+    if added or not indexed:
+        return rebuild_attributes(connection)
+    return 0
+
+
+def facet_counts(matched_query):
+    """
+    Фасеты для боковой панели фильтров одним запросом (UNION ALL по четырём справочникам).
+    matched_query — запрос товаров с уже наложенными фильтрами.
+    Возвращает {'size': [('M', 12), ('L', 7)], 'tag': [...], 'brand': [...], 'color': [...]}
+    """
+    # models сам импортирует этот модуль (слушатели), поэтому импорт здесь
+    from models import db, Product, ProductSize, ProductTag, Brand, Color
+
+    matched = (
+        matched_query.order_by(None)
+        .with_entities(Product.id.label("id"), Product.brand_id.label("brand_id"),
+                       Product.color_id.label("color_id"))
+        .cte("matched")
+    )
+
+    parts = []
+    for kind, model in (("size", ProductSize), ("tag", ProductTag)):
+        parts.append(
+            select(literal(kind).label("kind"), model.value.label("value"), func.count().label("cnt"))
+            .join(matched, matched.c.id == model.product_id)
+            .group_by(model.value)
+        )
+    for kind, model, column in (("brand", Brand, matched.c.brand_id), ("color", Color, matched.c.color_id)):
+        parts.append(
+            select(literal(kind).label("kind"), model.name.label("value"), func.count().label("cnt"))
+            .join(matched, column == model.id)
+            .group_by(model.id)
+        )
+
+    facets = {"size": [], "tag": [], "brand": [], "color": []}
+    for kind, value, cnt in db.session.execute(union_all(*parts)):
+        facets[kind].append((value, cnt))
+    for values in facets.values():
+        values.sort(key=lambda item: (-item[1], item[0]))
+    return facets
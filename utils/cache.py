@@ -0,0 +1,201 @@
+# простой кэш в памяти процесса: LRU + ограничение по «весу» (числу строк)
+
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+
+class QueryCache:
+    """
+    Кэш результатов запросов к товарам.
+    max_entries — сколько разных запросов держим,
+    max_weight — сколько строк (товаров) суммарно во всех записях; это и есть лимит памяти.
+    При переполнении выкидываются самые давно использованные записи
+    """
+
+    def __init__(self, max_entries=256, max_weight=5000):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self._data = OrderedDict()  # key -> (value, weight)
+        self._weight = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, max_entries=None, max_weight=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_weight is not None:
+                self.max_weight = max_weight
+            self._shrink()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, weight=1):
+        weight = max(1, weight)
+        with self._lock:
+            if weight > self.max_weight:
+                return  # одна запись больше всего кэша — не кладём
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._weight -= old[1]
+            self._data[key] = (value, weight)
+            self._weight += weight
+            self._shrink()
+
+    def get_or_load(self, key, loader):
+        """
+        Значение из кэша или loader() -> (value, weight).
+        Два потока могут загрузить одно и то же одновременно — не страшно, результат одинаковый
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value, weight = loader()
+            self.set(key, value, weight)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "weight": self._weight,
+                "max_entries": self.max_entries,
+                "max_weight": self.max_weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _shrink(self):
+        # вызывается под self._lock
+        while self._data and (len(self._data) > self.max_entries or self._weight > self.max_weight):
+            _, (_, weight) = self._data.popitem(last=False)
+            self._weight -= weight
+            self.evictions += 1
+
+
+# готовая страница для гостей: HTML с меткой вместо csrf-токена, версии данных на момент рендера,
+# метки для purge, когда нарисована (time.monotonic) и можно ли отдавать её устаревшей
+CachedPage = namedtuple('CachedPage', 'body versions tags created stale_ok')
+
+
+class PageCache(QueryCache):
+    """
+    Готовые страницы (CachedPage); вес — в КиБ.
+    purge(tags) убирает только страницы с этими метками, кроме тех, что можно отдавать устаревшими.
+    claim_refresh / release_refresh: устаревшую страницу перерисовывает один поток,
+    остальные в это время получают старую копию
+    """
+
+    def __init__(self, max_entries=512, max_weight=32 * 1024):
+        super().__init__(max_entries, max_weight)
+        self._refreshing = {}  # key -> когда поток взялся перерисовать страницу
+        self.purged = 0
+
+    def purge(self, tags):
+        with self._lock:
+            for key, (page, weight) in list(self._data.items()):
+                if page.tags & tags and not page.stale_ok:
+                    del self._data[key]
+                    self._weight -= weight
+                    self.purged += 1
+
+    def claim_refresh(self, key, timeout):
+        """True — перерисовывает этот поток; False — уже перерисовывают (не дольше timeout секунд)"""
+        now = time.monotonic()
+        with self._lock:
+            started = self._refreshing.get(key)
+            if started is not None and now - started < timeout:
+                return False
+            self._refreshing[key] = now
+            return True
+
+    def release_refresh(self, key):
+        with self._lock:
+            self._refreshing.pop(key, None)
+
+    def stats(self):
+        return {**super().stats(), "purged": self.purged}
+
+
+class TTLCache:
+    """
+    Маленький кэш с временем жизни записей: устаревшее не отдаётся, даже если никто его не сбросил.
+    Для данных, которые другие воркеры могут поменять незаметно для этого процесса
+    """
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires, value)
+        self._lock = Lock()
+
+    def configure(self, max_entries=None, ttl=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl is not None:
+                self.ttl = ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# общий кэш каталога; сбрасывается после commit, в котором менялись товары или категории
+query_cache = QueryCache()
+
+# готовый HTML карточек товаров (и JSON для окна товара); вес — в КиБ
+fragment_cache = QueryCache(max_entries=4096, max_weight=16 * 1024)
+
+# страницы для гостей (главная, каталог, новинки, товар, «О нас»); вес — в КиБ
+page_cache = PageCache()
+
+# выдача поиска: канонические параметры -> список id и фасеты; годится, пока не сменилось поколение каталога
+search_cache = TTLCache(max_entries=1024, ttl=600)
+
+# вошедшие пользователи ('user:1' -> User): чтобы не ходить в БД на каждый запрос
+principal_cache = TTLCache()
@@ -0,0 +1,114 @@
+# корзина: добавление и изменение позиций без гонок (одна строка на пользователя + товар + размер)
+
+from datetime import datetime
+from sqlalchemy import delete, update, func
+from sqlalchemy.dialects.sqlite import insert
+from models import db, CartItem, Product
+
+CART_LINE_INDEX = "uq_cart_item_line"
+
+
+def add_items(user_id, items):
+    """
+    items — [(product_id, size, quantity), ...]. Для каждой позиции один
+    INSERT ... ON CONFLICT DO UPDATE: уже лежащий в корзине товар просто прибавляет количество.
+    Возвращает (id позиции, итоговое количество) в том же порядке. Commit — за вызывающим (всё одной транзакцией)
+    """
+    stmt = insert(CartItem)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CartItem.user_id, CartItem.product_id, CartItem.size],
+        set_={'quantity': CartItem.quantity + stmt.excluded.quantity},
+    ).returning(CartItem.id, CartItem.quantity)
+
+    now = datetime.utcnow()
+    return [
+        db.session.execute(stmt.values(user_id=user_id, product_id=product_id, size=size or '',
+                                       quantity=quantity, added_at=now)).one()
+        for product_id, size, quantity in items
+    ]
+
+
+def merge_items(user_id, items):
+    """
+    Перенос корзины гостя при входе: все позиции одним многострочным INSERT ... ON CONFLICT,
+    совпавшие с уже лежащими в корзине складываются по количеству
+    """
+    if not items:
+        return
+    now = datetime.utcnow()
+    stmt = insert(CartItem).values([
+        dict(user_id=user_id, product_id=product_id, size=size or '', quantity=quantity, added_at=now)
+        for product_id, size, quantity in items
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CartItem.user_id, CartItem.product_id, CartItem.size],
+        set_={'quantity': CartItem.quantity + stmt.excluded.quantity},
+    )
+    db.session.execute(stmt)
+
+
+def set_quantities(user_id, updates):
+    """
+    updates — {cart_item_id: quantity}; 0 и меньше — удалить позицию.
+    Чужие позиции не трогаются. Возвращает число изменённых строк
+    """
+    changed = 0
+    for item_id, quantity in updates.items():
+        if quantity <= 0:
+            stmt = delete(CartItem).where(CartItem.id == item_id, CartItem.user_id == user_id)
+        else:
+            stmt = (update(CartItem).where(CartItem.id == item_id, CartItem.user_id == user_id)
+                    .values(quantity=quantity))
+        changed += db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+    return changed
+
+
+def cart_summary(user_id):
+    """(число позиций, общая сумма) одним запросом — для значка и итога после изменения корзины"""
+    count, total = (
+        db.session.query(func.count(CartItem.id), func.coalesce(func.sum(CartItem.quantity * Product.price), 0))
+        .outerjoin(CartItem.product)
+        .filter(CartItem.user_id == user_id)
+        .one()
+    )
+    return count, total
+
+
+def cart_line(user_id, item_id):
+    """Одна позиция для JSON-ответа или None, если её нет (удалена)"""
+    row = (
+        db.session.query(CartItem.id, CartItem.product_id, CartItem.size, CartItem.quantity, Product.price,
+                         (CartItem.quantity * Product.price).label('line_total'))
+        .join(CartItem.product)
+        .filter(CartItem.id == item_id, CartItem.user_id == user_id)
+        .one_or_none()
+    )
+    return dict(row._mapping) if row else None
+
+
+def ensure_cart_constraints(connection):
+    """
+    Старые базы: позиции без размера хранились как NULL, а дубли одной позиции могли появиться
+    при двойном клике. Склеиваем дубли (количества складываются) и создаём уникальный индекс.
+    Возвращает число удалённых дублей
+    """
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (CART_LINE_INDEX,)
+    ).scalar()
+    if exists:
+        return 0
+
+    connection.exec_driver_sql("UPDATE cart_item SET size = '' WHERE size IS NULL")
+    connection.exec_driver_sql(
+        "UPDATE cart_item SET quantity = ("
+        "  SELECT SUM(c.quantity) FROM cart_item c"
+        "  WHERE c.user_id = cart_item.user_id AND c.product_id = cart_item.product_id AND c.size = cart_item.size"
+        ") WHERE id IN (SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id, size HAVING COUNT(*) > 1)"
+    )
+    removed = connection.exec_driver_sql(
+        "DELETE FROM cart_item WHERE id NOT IN (SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id, size)"
+    ).rowcount
+    connection.exec_driver_sql(
+        f"CREATE UNIQUE INDEX {CART_LINE_INDEX} ON cart_item (user_id, product_id, size)"
+    )
+    return removed
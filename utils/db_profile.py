@@ -0,0 +1,57 @@
+# настройки SQLite для нескольких потоков/воркеров: WAL, PRAGMA на каждое соединение,
+# пул соединений и (по желанию) отдельный пул только для чтения для GET-запросов
+
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql import Select
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',        # читатели не ждут писателя и наоборот
+    'synchronous': 'NORMAL',      # в WAL не теряет целостность, fsync только на checkpoint
+    'busy_timeout': 5000,         # мс: ждать чужую запись, а не сразу «database is locked»
+    'cache_size': -20000,         # ~20 МБ страниц на соединение (минус — в КиБ)
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# эти PRAGMA меняют файл базы — на соединении только для чтения их не выставить
+_WRITE_PRAGMAS = ('journal_mode', 'synchronous')
+
+
+def apply_pragmas(engine, pragmas):
+    """PRAGMA действуют в пределах соединения — выставляем на каждом новом соединении пула"""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def create_read_engine(database_path, pragmas, **engine_options):
+    """
+    Второй пул к тому же файлу в режиме mode=ro: GET-запросы не занимают соединения,
+    которые нужны для записи, и физически не могут ничего записать
+    """
+    engine = create_engine(f"sqlite:///file:{database_path}?mode=ro&uri=true", **engine_options)
+    read_pragmas = {k: v for k, v in pragmas.items() if k not in _WRITE_PRAGMAS}
+    read_pragmas['query_only'] = 1
+    apply_pragmas(engine, read_pragmas)
+    return engine
+
+
+class RoutingSession(Session):
+    """
+    SELECT внутри GET/HEAD-запроса идёт в пул только для чтения (если он включён, см. SQLITE_READ_POOL).
+    INSERT/UPDATE/DELETE, flush и db.session.connection() — всегда в основной движок
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and isinstance(clause, Select) and not self._flushing
+                and has_request_context() and request.method in ('GET', 'HEAD')):
+            engine = current_app.extensions.get('sqlite_read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
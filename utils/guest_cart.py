@@ -0,0 +1,94 @@
+# корзина гостя: в подписанной cookie, без записей в базу; при входе переносится в cart_item
+
+from itsdangerous import URLSafeSerializer, BadSignature
+
+COOKIE_NAME = "guest_cart"
+MAX_LINES = 30      # cookie не больше пары килобайт
+MAX_QUANTITY = 99
+
+
+class GuestCartFull(ValueError):
+    """В корзине гостя уже MAX_LINES позиций"""
+
+
+class GuestCart:
+    """
+    Позиции [product_id, size, quantity] — одна на товар + размер, как в cart_item.
+    changed — нужно ли переписать cookie в ответе
+    """
+
+    def __init__(self, lines=None):
+        self.lines = lines or []
+        self.changed = False
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return (tuple(line) for line in self.lines)
+
+    def _find(self, product_id, size):
+        for line in self.lines:
+            if line[0] == product_id and line[1] == size:
+                return line
+        return None
+
+    def get(self, product_id, size):
+        line = self._find(product_id, size)
+        return line[2] if line else 0
+
+    def add(self, product_id, size, quantity=1):
+        """Возвращает новое количество позиции"""
+        line = self._find(product_id, size)
+        if line is None:
+            if len(self.lines) >= MAX_LINES:
+                raise GuestCartFull(f"В корзине гостя не больше {MAX_LINES} позиций — войдите, чтобы добавить ещё")
+            line = [product_id, size, 0]
+            self.lines.append(line)
+        line[2] = min(MAX_QUANTITY, line[2] + quantity)
+        self.changed = True
+        return line[2]
+
+    def set(self, product_id, size, quantity):
+        """Новое количество (0 — удалить). False, если такой позиции нет"""
+        line = self._find(product_id, size)
+        if line is None:
+            return False
+        if quantity <= 0:
+            self.lines.remove(line)
+        else:
+            line[2] = min(MAX_QUANTITY, quantity)
+        self.changed = True
+        return True
+
+    def clear(self):
+        self.lines = []
+        self.changed = True
+
+
+def _serializer(secret_key):
+    return URLSafeSerializer(secret_key, salt="guest-cart")
+
+
+def load_guest_cart(cookie_value, secret_key):
+    """Корзина из cookie; подделанная, повреждённая или подписанная старым ключом — пустая"""
+    if not cookie_value:
+        return GuestCart()
+    try:
+        raw = _serializer(secret_key).loads(cookie_value)
+    except BadSignature:
+        return GuestCart()
+
+    lines = []
+    for item in raw if isinstance(raw, list) else []:
+        try:
+            product_id, size, quantity = int(item[0]), str(item[1]), int(item[2])
+        except (TypeError, ValueError, IndexError, KeyError):
+            continue
+        if quantity > 0 and len(lines) < MAX_LINES:
+            lines.append([product_id, size, min(quantity, MAX_QUANTITY)])
+    return GuestCart(lines)
+
+
+def dump_guest_cart(cart, secret_key):
+    return _serializer(secret_key).dumps(cart.lines)
@@ -0,0 +1,152 @@
+# фото произвольной ширины по запросу (/img/<id>/<width>.<fmt>) и дисковый кэш для них
+
+import os
+import time
+import threading
+from threading import Lock
+
+# столько секунд живёт недописанный .tmp — дольше значит, что воркер упал посреди записи
+STALE_TMP_SECONDS = 600
+
+
+class DiskCache:
+    """
+    Папка с готовыми файлами, суммарный размер ограничен max_bytes.
+    Папка общая для всех воркеров, поэтому индекса в памяти нет: есть ли файл — смотрим на диске,
+    а после записи нового файла сканируем папку и удаляем давно не запрошенные файлы, чьи бы они ни были.
+    Время последнего обращения хранится в mtime файла
+    """
+
+    def __init__(self, folder=None, max_bytes=256 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._inflight = {}  # имя -> Event: этот файл прямо сейчас делает другой поток
+        self._files = 0      # по последнему сканированию папки
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, folder, max_bytes=None):
+        self.folder = folder
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    def get_or_create(self, name, create):
+        """
+        Путь к файлу name из кэша; если его нет — create(path) делает файл по этому пути.
+        Одновременные запросы одного и того же файла в процессе ждут первый, а не режут картинку заново
+        """
+        path = os.path.join(self.folder, name)
+
+        while True:
+            try:
+                os.utime(path)  # обращение — свежий mtime, файл уходит в конец очереди на удаление
+                with self._lock:
+                    self.hits += 1
+                return path
+            except FileNotFoundError:
+                pass
+
+            with self._lock:
+                event = self._inflight.get(name)
+                if event is None:
+                    event = self._inflight[name] = threading.Event()
+                    self.misses += 1
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                event.wait()
+                continue  # файл готов (или у первого не вышло — тогда пробуем сами)
+
+            # своё временное имя у каждого процесса: два воркера могут делать один файл одновременно
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                try:
+                    create(tmp_path)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                    raise
+                self._evict(keep=name)
+            finally:
+                with self._lock:
+                    self._inflight.pop(name, None)
+                event.set()
+            return path
+
+    def discard(self, prefix):
+        """Удаляет все файлы, имя которых начинается с prefix (фото товара заменили или удалили)"""
+        if not self.folder or not os.path.isdir(self.folder):
+            return
+        with os.scandir(self.folder) as entries:
+            names = [e.name for e in entries if e.name.startswith(prefix)]
+        for name in names:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": self._files,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self, keep):
+        """
+        Размер папки — сканированием (туда пишут все воркеры); пока он больше max_bytes,
+        удаляются файлы с самым старым mtime. Только что сделанный keep не трогаем,
+        даже если он один больше лимита
+        """
+        now = time.time()
+        files = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # удалил другой воркер
+                if entry.name.endswith(".tmp"):
+                    if now - st.st_mtime > STALE_TMP_SECONDS:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                if entry.is_file():
+                    files.append((st.st_mtime, entry.name, st.st_size))
+
+        total = sum(size for _, _, size in files)
+        evicted = 0
+        for _, name, size in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass  # уже удалил другой воркер — места всё равно освободилось
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._files = len(files) - evicted
+            self._bytes = total
+            self.evictions += evicted
+
+
+# общий на процесс; папка и лимит задаются в app.py
+image_cache = DiskCache()
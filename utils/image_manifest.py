@@ -0,0 +1,126 @@
+# какие размеры/форматы фото есть на диске — в памяти, чтобы не дёргать os.path.exists на каждую карточку
+
+import json
+import os
+import re
+import time
+from threading import Lock
+
+# имя файла варианта: <base>_<size>.<ext>
+_VARIANT_RE = re.compile(r"^([0-9a-f]+)_(thumb|medium|full)\.(jpg|webp|avif)$")
+EXT_FORMATS = {'jpg': 'jpeg', 'webp': 'webp', 'avif': 'avif'}
+
+
+def write_manifest(manifest_folder, base_name, records):
+    """Запись о вариантах фото — делает тот, кто их нарезал (в том числе процесс пула)"""
+    os.makedirs(manifest_folder, exist_ok=True)
+    path = os.path.join(manifest_folder, f"{base_name}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(records, f)
+    os.replace(path + ".tmp", path)
+
+
+class ImageManifest:
+    """
+    base -> {(size, format): {'file', 'width', 'height', 'bytes'}}.
+    Заполняется одним проходом по папке при первом обращении, дальше — из json-записей,
+    которые пишет обработчик фото. Промахи (фото ещё в обработке) запоминаются на negative_ttl секунд
+    """
+
+    def __init__(self, negative_ttl=2.0):
+        self.upload_folder = None
+        self.manifest_folder = None
+        self.canvas_sizes = {}
+        self.negative_ttl = negative_ttl
+        self._data = {}
+        self._missing = {}   # base -> до какого времени не проверять снова
+        self._loaded = False
+        self._lock = Lock()
+
+    def configure(self, upload_folder, manifest_folder, canvas_sizes):
+        self.upload_folder = upload_folder
+        self.manifest_folder = manifest_folder
+        self.canvas_sizes = canvas_sizes  # {'thumb': (300, 400), ...} — все варианты ровно такого размера
+
+    def get(self, base_name):
+        """Варианты фото или None, если их (пока) нет"""
+        if not self._loaded:
+            self._scan()
+        variants = self._data.get(base_name)
+        if variants is not None:
+            return variants
+
+        now = time.monotonic()
+        if self._missing.get(base_name, 0) > now:
+            return None
+        variants = self._read_record(base_name)
+        with self._lock:
+            if variants:
+                self._data[base_name] = variants
+                self._missing.pop(base_name, None)
+            else:
+                self._missing[base_name] = now + self.negative_ttl
+        return variants
+
+    def add(self, base_name, records):
+        with self._lock:
+            self._data[base_name] = self._index(records)
+            self._missing.pop(base_name, None)
+
+    def discard(self, base_name):
+        with self._lock:
+            self._data.pop(base_name, None)
+        if self.manifest_folder:
+            try:
+                os.remove(os.path.join(self.manifest_folder, f"{base_name}.json"))
+            except FileNotFoundError:
+                pass
+
+    def _index(self, records):
+        return {(r['size'], r['format']): r for r in records}
+
+    def _read_record(self, base_name):
+        try:
+            with open(os.path.join(self.manifest_folder, f"{base_name}.json"), encoding="utf-8") as f:
+                return self._index(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _scan(self):
+        """
+        Один проход по папке с фото: так в манифест попадают и старые загрузки без json-записей.
+        Размеры картинок известны заранее (все варианты — на холсте фиксированного размера)
+        """
+        with self._lock:
+            if self._loaded:
+                return
+            # у новых загрузок есть json-запись — их читаем по ней (get), не по файлам
+            recorded = set()
+            if self.manifest_folder and os.path.isdir(self.manifest_folder):
+                with os.scandir(self.manifest_folder) as entries:
+                    recorded = {e.name[:-5] for e in entries if e.name.endswith(".json")}
+
+            data = {}
+            if self.upload_folder and os.path.isdir(self.upload_folder):
+                with os.scandir(self.upload_folder) as entries:
+                    for entry in entries:
+                        match = _VARIANT_RE.match(entry.name)
+                        if not match:
+                            continue
+                        base, size, ext = match.groups()
+                        if base in recorded:
+                            continue
+                        width, height = self.canvas_sizes.get(size, (None, None))
+                        data.setdefault(base, {})[(size, EXT_FORMATS[ext])] = {
+                            'size': size, 'format': EXT_FORMATS[ext], 'file': entry.name,
+                            'width': width, 'height': height, 'bytes': entry.stat().st_size,
+                        }
+            # недорезанные фото (нет thumb.jpg) не запоминаем — их найдёт get() позже
+            data = {base: v for base, v in data.items() if ('thumb', 'jpeg') in v}
+            data.update(self._data)
+            self._data = data
+            self._loaded = True
+
+
+# общий на процесс; папки задаются в app.py
+image_manifest = ImageManifest()
@@ -1,74 +1,323 @@
 # работа с фотографиями - чтоб добавлять правильно)
 
 import os
-import uuid
-from PIL import Image
+import time
+import hashlib
+from threading import Lock
+from PIL import Image, ImageOps, features
 from flask import current_app
+from utils.image_manifest import image_manifest, write_manifest
+from utils.image_cache import image_cache
+from utils.process_pool import get_pool, on_fork
 
-def process_product_image(uploaded_file, delete_old_image=None):
+# от большего к меньшему: каждый следующий размер режется из предыдущего
+SIZES = {
+    'full': (1200, 1600),
+    'medium': (600, 800),
+    'thumb': (300, 400)
+}
+
+# формат -> (расширение, параметры сохранения). JPEG есть всегда — на него ссылается БД
+FORMATS = {
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 92, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'format': 'WEBP', 'quality': 82, 'method': 4}),
+    'avif': ('avif', {'format': 'AVIF', 'quality': 60, 'speed': 8}),
+}
+
+
+def available_formats(wanted):
+    """Из запрошенных форматов — те, что умеет собранный Pillow (jpeg — всегда)"""
+    result = ['jpeg']
+    for fmt in wanted:
+        if fmt != 'jpeg' and fmt in FORMATS and features.check(fmt):
+            result.append(fmt)
+    return result
+
+
+# фото, отправленные в пул этим процессом и ещё не обработанные (base_name)
+_jobs = set()
+_jobs_lock = Lock()
+
+
+@on_fork
+def _reset_jobs():
+    # задачи родителя остались в его пуле — ребёнок их не обрабатывает
+    global _jobs, _jobs_lock
+    _jobs = set()
+    _jobs_lock = Lock()
+
+
+def process_product_image(uploaded_file):
     """
     Принимает файл из формы (Flask-WTF FileField)
     Создаёт 3 размера: thumb (300×400), medium (600×800), full (1200×1600)
-    Возвращает имя thumb-файла для сохранения в БД
+    Возвращает имя thumb-файла для сохранения в БД.
+    Имя файлов — хэш содержимого: одно и то же фото (например, для разных расцветок)
+    хранится и режется один раз. Старое фото здесь не удаляется — см. delete_product_images.
+    При IMAGE_ASYNC файл только кладётся в staging, а размеры делает пул процессов —
+    до их появления в шаблонах показывается placeholder
     """
     if not uploaded_file or uploaded_file.filename == '':
         return "placeholder.jpg"
 
-    # удалить старые файлы, если передан delete_old_image 
-    if delete_old_image and delete_old_image != "placeholder.jpg":
-        _delete_old_images(delete_old_image)
+    # Открыть — только заголовок, без декодирования: проверяем, что это вообще картинка
+    try:
+        Image.open(uploaded_file).verify()
+    except Exception:
+        raise ValueError("Неподдерживаемый формат изображения")
+    uploaded_file.seek(0)
 
-    # Генерируем уникальное имя
-    unique_id = uuid.uuid4().hex
-    base_name = f"{unique_id}"
+    base_name = content_name(uploaded_file)
     upload_folder = current_app.config['UPLOAD_FOLDER']
+    if os.path.exists(os.path.join(upload_folder, f"{base_name}_thumb.jpg")):
+        return f"{base_name}_thumb.jpg"  # такое фото уже есть — нарезано раньше
 
-    # Открыть
-    try:
-        img = Image.open(uploaded_file)
-    except Exception as e:
-        raise ValueError("Неподдерживаемый формат изображения")
+    formats = available_formats(current_app.config.get('IMAGE_FORMATS', ('jpeg',)))
 
-    # Конвертируем в RGB 
-    if img.mode in ("RGBA", "LA", "P"):
-        img = img.convert("RGB")
+    if current_app.config.get('IMAGE_ASYNC'):
+        staging_path = _stage_upload(uploaded_file, base_name)
+        if staging_path is None:
+            return f"{base_name}_thumb.jpg"  # такое же фото уже в очереди
+        if not _submit(staging_path, upload_folder, base_name, formats):
+            os.remove(staging_path)
+            raise ValueError("Слишком много фото в обработке, попробуйте через минуту")
+    else:
+        records = render_variants(Image.open(uploaded_file), upload_folder, base_name, formats)
+        write_manifest(current_app.config['IMAGE_MANIFEST_FOLDER'], base_name, records)
+        image_manifest.add(base_name, records)
+
+    return f"{base_name}_thumb.jpg"  # возвращает только thumb для БД
 
-    sizes = {
-        'thumb': (300, 400),
-        'medium': (600, 800),
-        'full': (1200, 1600)
-    }
 
-    saved_files = []
+def content_name(uploaded_file):
+    """Имя файлов фото по содержимому: первые 32 hex-символа sha256 (как у прежних uuid4().hex)"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: uploaded_file.read(64 * 1024), b""):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()[:32]
 
-    for suffix, size in sizes.items():
-        img_copy = img.copy()
-        img_copy.thumbnail(size, Image.Resampling.LANCZOS)  # лучший алгоритм
 
-        # создаём белый фон 
+def render_variants(img, upload_folder, base_name, formats=('jpeg',)):
+    """
+    Все размеры из одного декодирования:
+    - JPEG с камеры декодируется сразу уменьшенным (draft), без полного 6000×4000
+    - грубое уменьшение — Image.reduce (дёшево), точное — LANCZOS
+    - full -> medium -> thumb каскадом, каждый из предыдущего
+    - каждый размер в каждом формате из formats; файл появляется целиком (через .tmp)
+    Возвращает записи для манифеста: [{'size', 'format', 'file', 'width', 'height', 'bytes'}]
+    """
+    largest = next(iter(SIZES.values()))
+
+    # draft работает только до загрузки пикселей и только для JPEG
+    if img.format == 'JPEG':
+        img.draft('RGB', largest)
+    img = ImageOps.exif_transpose(img)  # фото с телефона бывают «на боку»
+
+    # Конвертируем в RGB
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    records = []
+    current = img
+    for suffix, size in SIZES.items():
+        current = _shrink(current, size)
+
+        # создаём белый фон
         background = Image.new('RGB', size, (255, 255, 255))
-        offset = ((size[0] - img_copy.width) // 2, (size[1] - img_copy.height) // 2)
-        background.paste(img_copy, offset)
+        offset = ((size[0] - current.width) // 2, (size[1] - current.height) // 2)
+        background.paste(current, offset)
 
-        filename = f"{base_name}_{suffix}.jpg"
-        save_path = os.path.join(upload_folder, filename)
-        background.save(save_path, "JPEG", quality=92, optimize=True)
-        saved_files.append(filename)
+        for fmt in formats:
+            ext, params = FORMATS[fmt]
+            filename = f"{base_name}_{suffix}.{ext}"
+            save_path = os.path.join(upload_folder, filename)
+            background.save(save_path + ".tmp", **params)
+            os.replace(save_path + ".tmp", save_path)
+            records.append({'size': suffix, 'format': fmt, 'file': filename,
+                            'width': size[0], 'height': size[1], 'bytes': os.path.getsize(save_path)})
 
-    return f"{base_name}_thumb.jpg"  # возвращает только thumb для БД
+    return records
 
 
-def _delete_old_images(old_thumb_name):
-    """Удаляем все три размера старого изображения"""
-    if not old_thumb_name or old_thumb_name == "placeholder.jpg":
-        return
+def render_width(source_path, dest_path, width, fmt):
+    """
+    Вариант фото нужной ширины (для /img/<id>/<width>.<fmt>) из готового full-размера.
+    Пропорции — как у источника; больше источника не увеличиваем
+    """
+    with Image.open(source_path) as img:
+        width = min(width, img.width)
+        height = round(img.height * width / img.width)
+        if img.format == 'JPEG':
+            img.draft('RGB', (width, height))
+        img = _shrink(img.convert('RGB'), (width, height))
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+        img.save(dest_path, **FORMATS[fmt][1])
+
+
+def _shrink(img, size):
+    """Вписывает картинку в size: сначала целочисленный reduce, потом LANCZOS"""
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.width > size[0] or img.height > size[1]:
+        img = img.copy()
+        img.thumbnail(size, Image.Resampling.LANCZOS)  # лучший алгоритм
+    return img
+
+
+def image_status(thumb_name):
+    """
+    'ready' / 'pending' / 'failed' — по файлам, поэтому видно из любого воркера
+    """
+    if not thumb_name or thumb_name == "placeholder.jpg":
+        return 'ready'
+    base = thumb_name.replace("_thumb.jpg", "")
+    staging = current_app.config['IMAGE_STAGING_FOLDER']
+    if os.path.exists(os.path.join(staging, f"{base}.error")):
+        return 'failed'
+    if os.path.exists(os.path.join(staging, f"{base}.upload")):
+        return 'pending'
+    return 'ready'
+
+
+# ---------- фоновая обработка ----------
+
+def _stage_upload(uploaded_file, base_name):
+    """
+    Путь к файлу в staging или None, если это же фото уже ждёт обработки.
+    Очередь пула живёт только в памяти: если воркер убили или сервер перезапустили, .upload
+    остаётся без задачи. Такой файл (этот процесс его не обрабатывает, и он старше
+    IMAGE_STAGING_TIMEOUT) записывается заново, и фото снова ставится в очередь
+    """
+    staging = current_app.config['IMAGE_STAGING_FOLDER']
+    os.makedirs(staging, exist_ok=True)
+    path = os.path.join(staging, f"{base_name}.upload")
+    try:
+        with open(path, "xb") as f:
+            uploaded_file.save(f)
+    except FileExistsError:
+        if not _is_abandoned(path, base_name):
+            return None
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            uploaded_file.save(f)
+        os.replace(tmp_path, path)
+    # прошлая попытка с этим фото могла упасть — начинаем заново
+    try:
+        os.remove(os.path.join(staging, f"{base_name}.error"))
+    except FileNotFoundError:
+        pass
+    return path
+
 
-    base = old_thumb_name.replace("_thumb.jpg", "")
-    suffixes = ["thumb", "medium", "full"]
-    for suffix in suffixes:
-        old_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{base}_{suffix}.jpg")
+def _is_abandoned(staging_path, base_name):
+    """Файл в staging, который никто не обрабатывает: не наша задача и лежит дольше таймаута"""
+    with _jobs_lock:
+        if base_name in _jobs:
+            return False
+    try:
+        age = time.time() - os.path.getmtime(staging_path)
+    except FileNotFoundError:
+        return True  # обработка только что закончилась — повторная ничего не испортит
+    # моложе — скорее всего, его прямо сейчас режет соседний воркер
+    return age > current_app.config.get('IMAGE_STAGING_TIMEOUT', 120)
+
+
+def process_abandoned_uploads(max_age):
+    """
+    Доделывает здесь же, без пула, фото из staging старше max_age секунд — их обработка оборвалась.
+    Для scripts/gc_images.py; нужен контекст приложения. Возвращает, сколько файлов обработано
+    """
+    staging = current_app.config['IMAGE_STAGING_FOLDER']
+    if not os.path.isdir(staging):
+        return 0
+    formats = available_formats(current_app.config.get('IMAGE_FORMATS', ('jpeg',)))
+    cutoff = time.time() - max_age
+    with os.scandir(staging) as entries:
+        stale = [e.path for e in entries if e.name.endswith(".upload") and e.stat().st_mtime < cutoff]
+    done = 0
+    for path in stale:
+        base_name = os.path.basename(path)[:-len(".upload")]
         try:
-            if os.path.exists(old_path):
+            _process_staged(path, current_app.config['UPLOAD_FOLDER'], base_name, formats,
+                            current_app.config['IMAGE_MANIFEST_FOLDER'])
+            done += 1
+        except Exception as e:
+            current_app.logger.warning("Не удалось обработать %s: %s", path, e)  # причина — в .error
+    return done
+
+
+def _submit(staging_path, upload_folder, base_name, formats):
+    """False, если очередь заполнена"""
+    # пул для фото — один на веб-процесс, создаётся при первой загрузке; очередь ограничена:
+    # в работе + ожидании не больше IMAGE_QUEUE_SIZE фото
+    pool, slots = get_pool('images', current_app.config.get('IMAGE_WORKERS', 2),
+                           current_app.config.get('IMAGE_QUEUE_SIZE', 16), initializer=_worker_init)
+    if not slots.acquire(blocking=False):
+        return False
+    with _jobs_lock:
+        _jobs.add(base_name)
+    try:
+        future = pool.submit(_process_staged, staging_path, upload_folder, base_name, formats,
+                             current_app.config['IMAGE_MANIFEST_FOLDER'])
+    except Exception:
+        _job_done(base_name, slots)
+        raise
+    future.add_done_callback(lambda f: _job_done(base_name, slots))
+    return True
+
+
+def _job_done(base_name, slots):
+    with _jobs_lock:
+        _jobs.discard(base_name)
+    slots.release()
+
+
+def _worker_init():
+    # фото подождут, покупатели — нет
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def _process_staged(staging_path, upload_folder, base_name, formats, manifest_folder):
+    """Выполняется в процессе пула"""
+    try:
+        with Image.open(staging_path) as img:
+            records = render_variants(img, upload_folder, base_name, formats)
+        write_manifest(manifest_folder, base_name, records)
+    except Exception as e:
+        with open(os.path.splitext(staging_path)[0] + ".error", "w", encoding="utf-8") as f:
+            f.write(str(e))
+        raise
+    finally:
+        try:
+            os.remove(staging_path)
+        except OSError:
+            pass
+
+
+def delete_product_images(thumb_name):
+    """
+    Удаляем все размеры и форматы изображения.
+    Фото может быть общим у нескольких товаров — вызывать, только когда на него больше никто не ссылается.
+    Что не удалось удалить, подберёт scripts/gc_images.py
+    """
+    if not thumb_name or thumb_name == "placeholder.jpg":
+        return
+
+    base = thumb_name.replace("_thumb.jpg", "")
+    image_manifest.discard(base)
+    image_cache.discard(base + "_")
+    for suffix in SIZES:
+        for ext, _ in FORMATS.values():
+            old_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{base}_{suffix}.{ext}")
+            try:
                 os.remove(old_path)
-        except:
-            pass
\ No newline at end of file
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                current_app.logger.warning("Не удалось удалить %s: %s", old_path, e)
@@ -0,0 +1,58 @@
+# индексы каталога для старых баз и проверка планов запросов (EXPLAIN QUERY PLAN)
+
+import re
+
+# маленькие справочники — полный просмотр дешевле любого индекса
+SMALL_TABLES = {"category", "brand", "color", "admin", "cache_version"}
+
+# ix_product_search_text: LIKE '%..%' его не использует, а запись товара он замедлял;
+# brand_id / color_id теперь в составных индексах с created_at
+OBSOLETE_INDEXES = ("ix_product_search_text", "ix_product_brand_id", "ix_product_color_id")
+
+_SCAN_RE = re.compile(r"^SCAN (\w+)( USING (?:COVERING )?INDEX| VIRTUAL TABLE)?")
+_TABLE_RE = re.compile(r"^(?:SCAN|SEARCH) (\w+)")
+
+
+def ensure_catalog_indexes(connection):
+    """
+    db.create_all() не добавляет индексы в уже существующие таблицы — создаём недостающие
+    индексы product и удаляем устаревшие. Возвращает имена созданных индексов
+    """
+    from models import Product  # models импортирует utils — здесь, чтобы не было цикла
+
+    existing = {row[0] for row in connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'product'"
+    )}
+    created = []
+    for index in Product.__table__.indexes:
+        if index.name not in existing:
+            index.create(connection)
+            created.append(index.name)
+    for name in OBSOLETE_INDEXES:
+        if name in existing:
+            connection.exec_driver_sql(f"DROP INDEX {name}")
+    return created
+
+
+def explain(connection, statement, parameters=()):
+    """Строки плана: ['SEARCH product USING INDEX ...', ...]"""
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def plan_problems(plan, tables):
+    """
+    Что в плане плохо для страницы каталога: полный просмотр большой таблицы из tables
+    (просмотр CTE и подзапросов — не таблица, его не считаем) и сортировка во временном B-дереве
+    (ORDER BY не по индексу), если в запросе участвует хоть одна большая таблица
+    """
+    big = set(tables) - SMALL_TABLES
+    used = {match.group(1) for match in map(_TABLE_RE.match, plan) if match}
+    problems = []
+    for detail in plan:
+        scan = _SCAN_RE.match(detail)
+        if scan and not scan.group(2) and scan.group(1) in big:
+            problems.append(detail)
+        elif detail.startswith("USE TEMP B-TREE FOR") and "ORDER BY" in detail and used & big:
+            problems.append(detail)
+    return problems
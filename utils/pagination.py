@@ -0,0 +1,89 @@
+# постраничный вывод по ключу (keyset / cursor), без OFFSET
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_, DateTime, Integer, Float
+
+
+def encode_cursor(values):
+    """[datetime, 15] -> короткая строка для URL"""
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Обратно в список значений; None — если курсора нет или он битый"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _cursor_value(column, value):
+    """
+    Значение из курсора в тип колонки: дата — из ISO-строки, id — int, rank — число.
+    Курсор приходит из URL, его могли подделать — не тот тип -> ValueError
+    """
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"bad cursor value: {value!r}")
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError(f"bad cursor value: {value!r}")
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Integer):
+        # SQLite хранит целые в 64 битах — больше драйвер не передаст (OverflowError)
+        if not isinstance(value, int) or not -2 ** 63 <= value < 2 ** 63:
+            raise ValueError(f"bad cursor value: {value!r}")
+        return value
+    if isinstance(column.type, Float):
+        if not isinstance(value, (int, float)):
+            raise ValueError(f"bad cursor value: {value!r}")
+        return float(value)
+    return value
+
+
+def _after_condition(order_by, after):
+    """
+    Условие «строго после курсора» для сортировки order_by = [(колонка, desc), ...]
+    (a, b) после (x, y):  a > x  OR  (a = x AND b > y)   (для desc — знак наоборот)
+    """
+    values = [_cursor_value(column, value) for (column, _), value in zip(order_by, after)]
+
+    branches = []
+    for i, (column, desc) in enumerate(order_by):
+        equal = [order_by[j][0] == values[j] for j in range(i)]
+        step = column < values[i] if desc else column > values[i]
+        branches.append(and_(*equal, step))
+    return or_(*branches)
+
+
+def keyset_page(query, order_by, cursor, page_size, key):
+    """
+    Одна страница query после cursor.
+    order_by — [(колонка, desc)], последней должна идти уникальная колонка (id),
+    key(row) — значения этих колонок у строки (для следующего курсора).
+    Возвращает (строки, курсор следующей страницы или None)
+    """
+    after = decode_cursor(cursor)
+    if after is not None and len(after) == len(order_by):
+        try:
+            query = query.filter(_after_condition(order_by, after))
+        except (ValueError, TypeError):
+            pass  # битый курсор — отдаём первую страницу
+
+    query = query.order_by(*[column.desc() if desc else column.asc() for column, desc in order_by])
+
+    # берём на одну строку больше — так видно, есть ли следующая страница
+    rows = query.limit(page_size + 1).all()
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(key(rows[-1]))
+    return rows, None
@@ -0,0 +1,63 @@
+# хэширование паролей (scrypt) в отдельном пуле процессов — чтобы волна входов не занимала веб-воркеры
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils.process_pool import get_pool
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Очередь на проверку паролей переполнена — пусть пользователь повторит попытку"""
+
+
+# параметры задаются из app.py (configure); значения по умолчанию — как у werkzeug
+_settings = {
+    'method': 'scrypt:32768:8:1',
+    'workers': 2,
+    'queue_size': 32,
+    'queue_timeout': 3.0,
+    'use_pool': False,
+}
+
+
+def configure(n=2 ** 15, r=8, p=1, workers=2, queue_size=32, queue_timeout=3.0, use_pool=True):
+    """
+    n, r, p — стоимость scrypt (n — степень двойки; память на хэш ≈ 128 * n * r байт).
+    workers — сколько хэшей считается одновременно, queue_size — сколько может ждать
+    """
+    _settings.update(method=f"scrypt:{n}:{r}:{p}", workers=workers, queue_size=queue_size,
+                     queue_timeout=queue_timeout, use_pool=use_pool)
+
+
+def hash_password(password):
+    return _run(_hash, password, _settings['method'])
+
+
+def verify_password(pwhash, password):
+    return _run(_check, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """True, если хэш посчитан с другими параметрами (или другим алгоритмом), чем сейчас настроено"""
+    return not pwhash or pwhash.split("$", 1)[0] != _settings['method']
+
+
+def _run(func, *args):
+    if not _settings['use_pool']:
+        return func(*args)
+    # в работе + в ожидании не больше queue_size паролей
+    pool, slots = get_pool('passwords', _settings['workers'], _settings['queue_size'])
+    if not slots.acquire(timeout=_settings['queue_timeout']):
+        raise PasswordHasherBusy("Слишком много входов одновременно, попробуйте ещё раз")
+    try:
+        return pool.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+# ---------- выполняется в процессах пула ----------
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
@@ -0,0 +1,59 @@
+# общие пулы процессов для тяжёлой работы вне веб-воркеров (фото, пароли)
+
+import os
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+# имя -> (пул, семафор очереди); пулы создаются при первом обращении, по одному на процесс
+_pools = {}
+_lock = Lock()
+_fork_hooks = []
+
+
+def get_pool(name, workers, queue_size, initializer=None):
+    """
+    Пул name и семафор на queue_size мест (в работе + в ожидании). Создаётся при первом вызове,
+    дальше workers и queue_size не меняются. Семафор занимает и освобождает вызывающий
+    """
+    with _lock:
+        entry = _pools.get(name)
+        if entry is None:
+            # spawn, а не fork: веб-процесс многопоточный
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=initializer)
+            entry = _pools[name] = (pool, BoundedSemaphore(queue_size))
+        return entry
+
+
+def shutdown(wait=True):
+    """Останавливает все пулы; следующий get_pool создаст новые"""
+    global _pools
+    with _lock:
+        pools, _pools = _pools, {}
+    for pool, _ in pools.values():
+        # невыполненные задачи отменяем: фото из staging доделают позже, вход повторят
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def on_fork(func):
+    """func() вызовется в дочернем процессе после fork — сбросить своё состояние, связанное с пулом"""
+    _fork_hooks.append(func)
+    return func
+
+
+def _after_fork():
+    # serve.py форкает воркеры: пул родителя в ребёнке не работает (потоки управления не
+    # скопировались), а замок мог быть взят другим потоком в момент fork — начинаем с нуля
+    global _pools, _lock
+    _pools = {}
+    _lock = Lock()
+    for func in _fork_hooks:
+        func()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+atexit.register(shutdown)
@@ -0,0 +1,187 @@
+# ограничение частоты (попытки входа): скользящее окно по двум счётчикам, хранилище — на выбор
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class SlidingWindowLimiter:
+    """
+    Не больше limit событий за window секунд на ключ (ip:..., user:...).
+    Вместо списка времён — два счётчика: текущее окно и предыдущее.
+    Оценка = prev * (доля предыдущего окна, ещё попадающая в последние window секунд) + cur.
+    На каждую проверку — O(1) работы и O(1) памяти на ключ
+    """
+
+    def __init__(self, backend, limit, window):
+        self.backend = backend
+        self.limit = limit
+        self.window = window
+
+    def _now(self):
+        now = time.time()
+        index = int(now // self.window)
+        return index, (now - index * self.window) / self.window  # номер окна, сколько его прошло (0..1)
+
+    def _estimate(self, prev, cur, elapsed):
+        return prev * (1 - elapsed) + cur
+
+    def hit(self, key):
+        """Засчитать событие; возвращает сколько ещё осталось до блокировки"""
+        index, elapsed = self._now()
+        prev, cur = self.backend.incr(key, index)
+        return max(0, self.limit - math.ceil(self._estimate(prev, cur, elapsed)))
+
+    def remaining(self, key):
+        index, elapsed = self._now()
+        prev, cur = self.backend.get(key, index)
+        return max(0, self.limit - math.ceil(self._estimate(prev, cur, elapsed)))
+
+    def is_blocked(self, key):
+        return self.remaining(key) <= 0
+
+    def retry_after(self, key):
+        """Через сколько секунд ключ разблокируется (0 — не заблокирован)"""
+        index, elapsed = self._now()
+        prev, cur = self.backend.get(key, index)
+        if self._estimate(prev, cur, elapsed) <= self.limit - 1:
+            return 0
+        # пока идёт текущее окно, вклад prev убывает; cur уменьшится только в следующем окне
+        if prev and cur < self.limit:
+            free_at = 1 - (self.limit - 1 - cur) / prev
+            if elapsed < free_at < 1:
+                return math.ceil((free_at - elapsed) * self.window)
+        # в следующем окне cur становится prev и убывает так же
+        free_at = 1 - (self.limit - 1) / cur if cur else 0
+        return math.ceil((1 - elapsed + max(0.0, free_at)) * self.window)
+
+    def reset(self, key):
+        self.backend.delete(key)
+
+
+class MemoryLimiterBackend:
+    """
+    Счётчики в памяти процесса. Ключи старше двух окон удаляются раз в окно,
+    а общее число ключей ограничено max_keys (выкидываются давно не встречавшиеся)
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()  # key -> [window_index, cur, prev]
+        self._lock = Lock()
+        self._swept = None
+
+    def _counts(self, key, index):
+        # вызывается под self._lock
+        item = self._data.get(key)
+        if item is None:
+            return None
+        window_index, cur, prev = item
+        if window_index == index:
+            return item
+        item[:] = [index, 0, cur if window_index == index - 1 else 0]
+        return item
+
+    def incr(self, key, index):
+        with self._lock:
+            self._sweep(index)
+            item = self._counts(key, index)
+            if item is None:
+                item = self._data[key] = [index, 0, 0]
+            else:
+                self._data.move_to_end(key)
+            item[1] += 1
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+            return item[2], item[1]
+
+    def get(self, key, index):
+        with self._lock:
+            item = self._counts(key, index)
+            return (item[2], item[1]) if item else (0, 0)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _sweep(self, index):
+        if self._swept == index:
+            return
+        self._swept = index
+        for key in [k for k, (window_index, _, _) in self._data.items() if window_index < index - 1]:
+            del self._data[key]
+
+
+class SQLiteLimiterBackend:
+    """
+    Счётчики в отдельном файле SQLite — общие для всех воркеров на машине.
+    Одна строка на ключ, увеличение — один UPSERT. Старые окна чистятся раз в окно
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._swept = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit ("
+                "key TEXT PRIMARY KEY, win INTEGER NOT NULL, cur INTEGER NOT NULL, prev INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def _connect(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def incr(self, key, index):
+        con = self._connect()
+        if self._swept != index:
+            self._swept = index
+            con.execute("DELETE FROM rate_limit WHERE win < ?", (index - 1,))
+        # в SET справа — старые значения строки, поэтому prev считается от старого cur
+        prev, cur = con.execute(
+            "INSERT INTO rate_limit (key, win, cur, prev) VALUES (?, ?, 1, 0) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "prev = CASE WHEN win = excluded.win THEN prev "
+            "            WHEN win = excluded.win - 1 THEN cur ELSE 0 END, "
+            "cur = CASE WHEN win = excluded.win THEN cur + 1 ELSE 1 END, "
+            "win = excluded.win "
+            "RETURNING prev, cur",
+            (key, index),
+        ).fetchone()
+        return prev, cur
+
+    def get(self, key, index):
+        row = self._connect().execute(
+            "SELECT win, cur, prev FROM rate_limit WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return 0, 0
+        window_index, cur, prev = row
+        if window_index == index:
+            return prev, cur
+        return (cur if window_index == index - 1 else 0), 0
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM rate_limit WHERE key = ?", (key,))
+
+
+def create_limiter(backend, limit, window, path=None):
+    """backend: 'memory' (один процесс) или 'sqlite' (все воркеры видят одни счётчики, нужен path)"""
+    if backend == "memory":
+        store = MemoryLimiterBackend()
+    elif backend == "sqlite":
+        store = SQLiteLimiterBackend(path)
+    else:
+        raise ValueError(f"Неизвестное хранилище лимитера: {backend}")
+    return SlidingWindowLimiter(store, limit, window)
@@ -0,0 +1,129 @@
+# полнотекстовый поиск по товарам (SQLite FTS5)
+
+import re
+from sqlalchemy import text, Integer, Float
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = "product_fts"
+TRIGRAM_TABLE = "product_fts_trigram"
+
+# unicode61 + remove_diacritics 2: нормально режет кириллицу и убирает диакритику в латинице,
+# prefix '2 3' — отдельные индексы для коротких префиксов (быстрый поиск по началу слова)
+CREATE_FTS_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "search_text, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+# trigram — поиск по подстроке в середине слова (как старый LIKE '%q%'), но по индексу
+CREATE_TRIGRAM_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_TABLE} USING fts5("
+    "search_text, tokenize = 'trigram')"
+)
+
+# rowid в FTS-таблицах == product.id; ё -> е (unicode61 её не сворачивает)
+REBUILD_SQL = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"INSERT INTO {FTS_TABLE}(rowid, search_text) "
+    "SELECT id, replace(lower(search_text), 'ё', 'е') FROM product WHERE search_text IS NOT NULL",
+    f"DELETE FROM {TRIGRAM_TABLE}",
+    f"INSERT INTO {TRIGRAM_TABLE}(rowid, search_text) "
+    "SELECT id, replace(lower(search_text), 'ё', 'е') FROM product WHERE search_text IS NOT NULL",
+]
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(value):
+    """Нижний регистр и ё -> е — одинаково для индекса и для запроса"""
+    return (value or "").lower().replace("ё", "е")
+
+
+# таблицы есть? (запоминаем только положительный ответ)
+_index_ready = False
+
+
+def search_index_ready(connection):
+    """Есть ли FTS-таблицы в базе"""
+    global _index_ready
+    if not _index_ready:
+        rows = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE name IN (?, ?)", (FTS_TABLE, TRIGRAM_TABLE)
+        ).fetchall()
+        _index_ready = len(rows) == 2
+    return _index_ready
+
+
+def ensure_search_index(connection):
+    """
+    Создаёт FTS-таблицы, если их нет, и заполняет их из product.
+    Возвращает False, если SQLite собран без FTS5 — тогда поиск работает через LIKE
+    """
+    global _index_ready
+    if search_index_ready(connection):
+        return True
+    try:
+        connection.exec_driver_sql(CREATE_FTS_SQL)
+        connection.exec_driver_sql(CREATE_TRIGRAM_SQL)
+    except OperationalError as e:
+        print(f"FTS5 недоступен, поиск будет через LIKE: {e}")
+        return False
+    for stmt in REBUILD_SQL:
+        connection.exec_driver_sql(stmt)
+    _index_ready = True
+    return True
+
+
+def index_product(connection, product_id, search_text):
+    """Перезаписывает строку товара в обоих индексах"""
+    if not search_index_ready(connection):
+        return
+    search_text = normalize(search_text)
+    for table in (FTS_TABLE, TRIGRAM_TABLE):
+        connection.exec_driver_sql(f"DELETE FROM {table} WHERE rowid = ?", (product_id,))
+        if search_text:
+            connection.exec_driver_sql(
+                f"INSERT INTO {table}(rowid, search_text) VALUES (?, ?)", (product_id, search_text)
+            )
+
+
+def unindex_product(connection, product_id):
+    """Убирает товар из индексов"""
+    if not search_index_ready(connection):
+        return
+    for table in (FTS_TABLE, TRIGRAM_TABLE):
+        connection.exec_driver_sql(f"DELETE FROM {table} WHERE rowid = ?", (product_id,))
+
+
+def build_match_expression(q):
+    """
+    'Платье летн' -> '"платье"* "летн"*'  (все слова, каждое — как префикс)
+    Кавычки убирают спецсимволы FTS5 (AND, OR, NEAR, -, : и т.п.) из запроса
+    """
+    words = _WORD_RE.findall(normalize(q))
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def build_trigram_expression(q):
+    """Подстрока целиком; trigram умеет только строки от 3 символов"""
+    q = " ".join(normalize(q).split())
+    if len(q) < 3:
+        return None
+    return '"' + q.replace('"', '""') + '"'
+
+
+def match_subquery(q, trigram=False):
+    """
+    Подзапрос (id, rank) для join с Product.
+    rank = bm25, чем меньше — тем релевантнее. None, если искать нечего
+    """
+    table = TRIGRAM_TABLE if trigram else FTS_TABLE
+    expr = build_trigram_expression(q) if trigram else build_match_expression(q)
+    if not expr:
+        return None
+    return (
+        text(f"SELECT rowid AS id, bm25({table}) AS rank FROM {table} WHERE {table} MATCH :expr")
+        .bindparams(expr=expr)
+        .columns(id=Integer, rank=Float)
+        .subquery("fts")
+    )
@@ -0,0 +1,35 @@
+# постоянный SECRET_KEY: общий для всех воркеров и не меняется при перезапуске
+# (иначе сессии, «запомнить меня» и корзины гостей в cookie слетают)
+
+import os
+
+
+def load_secret_key(path):
+    """
+    Ключ из файла path; если файла нет — создаёт его (32 случайных байта, права 0600).
+    Воркеры стартуют одновременно: файл пишется во временный и появляется под своим именем
+    через os.link — атомарно, побеждает первый, остальные читают его ключ
+    """
+    try:
+        with open(path, "rb") as f:
+            key = f.read()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass  # другой процесс успел раньше — берём его ключ
+    finally:
+        os.unlink(tmp_path)
+
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,44 @@
+# счётчики версий данных в самой базе — общие для всех потоков и воркеров
+
+from threading import Lock
+
+CATEGORIES = "categories"   # меняется при любой записи в category
+CATALOG = "catalog"         # меняется при любой записи в product или category
+
+
+def bump_version(connection, name):
+    """+1 к версии в той же транзакции, что и изменение данных"""
+    connection.exec_driver_sql(
+        "INSERT INTO cache_version (name, version) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+        (name,),
+    )
+
+
+def read_versions(connection):
+    """{'categories': 3, 'catalog': 17} — один запрос по маленькой таблице"""
+    rows = connection.exec_driver_sql("SELECT name, version FROM cache_version").fetchall()
+    versions = {CATEGORIES: 0, CATALOG: 0}
+    versions.update(dict(rows))
+    return versions
+
+
+class VersionedSnapshot:
+    """
+    Данные, загруженные один раз на процесс и перечитываемые только
+    когда версия в базе стала другой
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = Lock()
+        self._version = None
+        self._data = None
+
+    def get(self, version):
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._data = self._loader()
+                    self._version = version
+        return self._data
@@ -0,0 +1,11 @@
+# точка входа для WSGI-серверов: serve.py (встроенный, несколько воркеров) или, например,
+#   gunicorn -w 4 --max-requests 1000 wsgi:app
+#   gunicorn -w 4 'app:create_app()'        — то же без предзагрузки шаблонов
+# Разработка: flask --app app run --debug (flask сам найдёт create_app) или python app.py.
+# Схему базы и шаблоны готовят заранее: flask --app app init-db, flask --app app compile-templates
+
+from app import create_app, load_templates
+
+app = create_app()
+# шаблоны — до первого запроса (из кэша байткода), чтобы первая страница не ждала компиляции
+load_templates(app)